@@ -0,0 +1,215 @@
+"""
+Mesures de performance sur des paquets synthétiques :
+
+    python benchmarks/bench.py -o results.json
+    python benchmarks/bench.py --sizes 9,1000 --baseline results.json
+
+Chaque cas génère un CSV et une archive ZIP d'images, puis mesure la lecture du CSV,
+l'ouverture du ZIP, build_pdf, la taille du PDF et la mémoire : pic des allocations Python
+(tracemalloc) et pic de mémoire résidente du processus, qui compte aussi les pixels PIL et les
+tampons hors de l'allocateur Python (Linux seulement).
+Avec --baseline, une régression au-delà de --tolerance fait échouer la commande.
+"""
+import argparse, io, json, os, platform, subprocess, sys, time, tracemalloc, zipfile
+from typing import List, Dict, Optional, NamedTuple, Callable
+
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from flashcard3 import DEFAULT_BACK_COLOR, RECTO_STYLE_FILL, RECTO_STYLE_FRAME, ZipImageStore, build_pdf, read_cards_from_csv
+from flashcard3.profiling import RssPeak
+
+# ----------------------------
+# Réglages
+# ----------------------------
+DEFAULT_SIZES = (9, 1000, 50000)
+DEFAULT_TOLERANCE = 0.25          # +25 % par rapport à la référence
+MIN_SECONDS_DELTA = 0.05          # en dessous, les écarts de temps sont du bruit
+COMPARED_METRICS = ("parse_s", "zip_load_s", "build_s", "pdf_bytes", "peak_mb")
+RSS_SAMPLE_SECONDS = 0.01         # période de relevé de la mémoire résidente
+
+DISTINCT_IMAGES = 8               # images distinctes dans l'archive, réutilisées par les cartes
+SMALL_PNG_SIZE = (256, 256)
+PHOTO_SIZE = (4000, 3000)         # 12 Mpx
+
+# ----------------------------
+# Paquets synthétiques
+# ----------------------------
+def small_png(i: int) -> bytes:
+    img = Image.new("RGBA", SMALL_PNG_SIZE, (0, 0, 0, 0))
+    ImageDraw.Draw(img).ellipse((16, 16, 240, 240), fill=(40 * i % 256, 120, 200, 255))
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
+
+def photo_jpeg(i: int) -> bytes:
+    img = Image.linear_gradient("L").resize(PHOTO_SIZE).convert("RGB")
+    ImageDraw.Draw(img).rectangle((400 * i % 3000, 500, 400 * i % 3000 + 900, 2500), fill=(200, 30 * i % 256, 40))
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=90)
+    return buf.getvalue()
+
+class Scenario(NamedTuple):
+    name: str
+    image_prefix: str                         # "" : pas d'image
+    make_image: Optional[Callable[[int], bytes]]
+    extension: str
+    with_text: bool
+    recto_color_style: str
+
+SCENARIOS = {
+    "text": Scenario("text", "", None, "", True, RECTO_STYLE_FILL),
+    "png": Scenario("png", "icon", small_png, ".png", True, RECTO_STYLE_FILL),
+    "photo": Scenario("photo", "photo", photo_jpeg, ".jpg", False, RECTO_STYLE_FILL),
+    "pc": Scenario("pc", "pc_photo", photo_jpeg, ".jpg", False, RECTO_STYLE_FILL),
+    "frame": Scenario("frame", "icon", small_png, ".png", True, RECTO_STYLE_FRAME),
+}
+
+def make_csv(scenario: Scenario, n_cards: int) -> str:
+    colors = ("bleu", "rouge", "vert", "jaune", "#3A7", "rose")
+    lines = ["question;texte;image_recto;image_verso"]
+    for i in range(n_cards):
+        image = f"{scenario.image_prefix}{i % DISTINCT_IMAGES}{scenario.extension}" if scenario.image_prefix else ""
+        question = f"({colors[i % len(colors)]}) Question {i}" if scenario.with_text else f"({colors[i % len(colors)]})"
+        # No ";" in the answer: it would shift the image columns and leave the rectos without images
+        answer = f"Réponse {i}, deuxième ligne" if scenario.with_text else ""
+        lines.append(f"{question};{answer};{image};{image if i % 2 else ''}")
+    return "\n".join(lines) + "\n"
+
+def make_zip(scenario: Scenario) -> Optional[bytes]:
+    if scenario.make_image is None:
+        return None
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_STORED) as z:
+        for i in range(DISTINCT_IMAGES):
+            z.writestr(f"{scenario.image_prefix}{i}{scenario.extension}", scenario.make_image(i))
+    return buf.getvalue()
+
+# ----------------------------
+# Mesures
+# ----------------------------
+def run_case(scenario: Scenario, n_cards: int, csv_text: str, zip_bytes: Optional[bytes], memory: bool) -> Dict:
+    def render() -> Dict:
+        started = time.perf_counter()
+        cards = read_cards_from_csv(csv_text)
+        parsed = time.perf_counter()
+        images = ZipImageStore(io.BytesIO(zip_bytes)) if zip_bytes else None
+        loaded = time.perf_counter()
+        output = io.BytesIO()
+        try:
+            report = build_pdf(
+                cards, DEFAULT_BACK_COLOR, output,
+                uploaded_recto_images=images,
+                recto_color_style=scenario.recto_color_style,
+                multi_page=True
+            )
+        finally:
+            if images is not None:
+                images.close()
+        built = time.perf_counter()
+        return {
+            "parse_s": round(parsed - started, 4),
+            "zip_load_s": round(loaded - parsed, 4),
+            "build_s": round(built - loaded, 4),
+            "pdf_bytes": len(output.getvalue()),
+            "sheets": report.sheets,
+            "images_embedded": report.images_embedded,
+            "errors": len(report.errors),
+        }
+
+    # Timings and resident memory without tracemalloc (it slows allocations down and adds its own
+    # bookkeeping), peak Python allocations in a second pass
+    result = {"case": f"{scenario.name}-{n_cards}", "scenario": scenario.name, "cards": n_cards}
+    with RssPeak(RSS_SAMPLE_SECONDS) as rss:
+        result.update(render())
+    if memory and rss.start_mb is not None:
+        # RSS seldom goes back down between cases: the growth during this one is recorded too
+        result["rss_peak_mb"] = rss.peak_mb
+        result["rss_growth_mb"] = round(rss.peak_mb - rss.start_mb, 1)
+    if memory:
+        tracemalloc.start()
+        try:
+            render()
+            result["peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 1e6, 2)
+        finally:
+            tracemalloc.stop()
+    return result
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results: List[Dict], baseline: Dict, tolerance: float) -> List[str]:
+    """Régressions par rapport à une exécution précédente (cas et métriques présents des deux côtés)."""
+    previous = {result["case"]: result for result in baseline.get("results", [])}
+    regressions = []
+    for result in results:
+        before = previous.get(result["case"])
+        if before is None:
+            continue
+        for metric in COMPARED_METRICS:
+            if metric not in result or metric not in before:
+                continue
+            limit = before[metric] * (1 + tolerance)
+            if metric.endswith("_s"):
+                limit = max(limit, before[metric] + MIN_SECONDS_DELTA)
+            if result[metric] > limit:
+                regressions.append(f"{result['case']} {metric} : {before[metric]} -> {result[metric]}")
+    return regressions
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Mesures de performance de flashcard3 sur des paquets synthétiques.")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)), help="nombres de cartes, séparés par des virgules")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"cas à mesurer parmi {', '.join(SCENARIOS)}")
+    parser.add_argument("-o", "--output", help="fichier JSON des résultats")
+    parser.add_argument("--baseline", help="résultats JSON d'une exécution précédente à comparer")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="hausse tolérée (0.25 = +25 %%)")
+    parser.add_argument("--no-memory", action="store_true", help="ne pas mesurer le pic mémoire (deux fois plus rapide)")
+    return parser
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    sizes = [int(size) for size in args.sizes.split(",") if size]
+    scenarios = [SCENARIOS[name] for name in args.scenarios.split(",") if name]
+
+    results = []
+    for scenario in scenarios:
+        zip_bytes = make_zip(scenario)
+        for n_cards in sizes:
+            result = run_case(scenario, n_cards, make_csv(scenario, n_cards), zip_bytes, memory=not args.no_memory)
+            results.append(result)
+            print(
+                f"{result['case']:<14} lecture {result['parse_s']:.3f} s  zip {result['zip_load_s']:.3f} s  "
+                f"pdf {result['build_s']:.3f} s  {result['pdf_bytes'] / 1e6:.2f} Mo"
+                + (f"  pic {result['peak_mb']:.1f} Mo" if "peak_mb" in result else "")
+                + (f"  RSS {result['rss_peak_mb']:.0f} Mo (+{result['rss_growth_mb']:.0f})" if "rss_peak_mb" in result else ""),
+                file=sys.stderr
+            )
+
+    run = {
+        "commit": git_commit(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(run, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"RÉGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
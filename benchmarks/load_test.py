@@ -0,0 +1,310 @@
+"""
+Test de charge de l'application Streamlit, sans navigateur ni réseau :
+
+    python benchmarks/load_test.py --sessions 20 --rounds 3 -o load.json
+    python benchmarks/load_test.py --sessions 5 --cards 1000 --scenario photo
+
+Chaque session simulée est un AppTest dans son propre thread : elle charge la page, envoie un CSV
+et une archive ZIP synthétiques (ceux de bench.py), puis, à chaque tour, change le style du recto,
+clique sur « Générer le PDF » et relance la page jusqu'à la fin de la génération. Toutes les
+sessions partagent le même processus, donc les caches Streamlit et le service de génération,
+comme sur un serveur. Résultats : latence de chaque exécution du script (centiles par action),
+débit et durée des générations, générations refusées, mémoire résidente du processus au fil du temps.
+
+AppTest installe un runtime Streamlit global le temps d'une exécution : les exécutions du script
+des différentes sessions passent donc une à une (l'attente est comptée dans la latence et mesurée
+à part), les générations tournent en parallèle dans le service de génération.
+"""
+import argparse, json, logging, os, platform, shutil, sys, tempfile, threading, time
+from typing import List, Dict, Optional, NamedTuple, Callable
+
+# ----------------------------
+# Réglages
+# ----------------------------
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+DEFAULT_SESSIONS = 20
+DEFAULT_ROUNDS = 2
+DEFAULT_CARDS = 90                # 10 feuilles
+POLL_SECONDS = 0.5                # comme PROGRESS_REFRESH_SECONDS dans l'application
+THINK_SECONDS = 1.0               # pause entre deux actions d'une session
+RUN_TIMEOUT_SECONDS = 120         # une exécution du script
+GENERATION_TIMEOUT_SECONDS = 600  # clic jusqu'au PDF disponible, file d'attente comprise
+RSS_SAMPLE_SECONDS = 0.5
+PERCENTILES = (50, 90, 95, 99)
+
+GENERATE_LABEL = "Générer le PDF"
+
+# Generation outcomes
+GENERATED = "générée"
+REFUSED = "refusée"        # RenderServiceBusy, affichée par st.error
+ENDED = "terminée sans PDF"
+TIMED_OUT = "délai dépassé"
+
+def percentiles(values: List[float]) -> Dict:
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+    summary = {"count": len(ordered)}
+    for p in PERCENTILES:
+        # Nearest rank
+        summary[f"p{p}"] = round(ordered[min(len(ordered) - 1, max(0, -(-p * len(ordered) // 100) - 1))], 4)
+    summary["max"] = round(ordered[-1], 4)
+    return summary
+
+class Settings(NamedTuple):
+    sessions: int
+    rounds: int
+    ramp_seconds: float
+    think_seconds: float
+    multi_page: bool
+    same_deck: bool
+
+class Rerun(NamedTuple):
+    session: int
+    action: str        # load, upload, option, generate, poll
+    started: float     # secondes depuis le début du test
+    seconds: float     # latence vue par la session, attente comprise
+    waited: float      # attente des exécutions des autres sessions
+    error: str
+
+class Generation(NamedTuple):
+    session: int
+    round: int
+    outcome: str
+    seconds: float     # clic jusqu'au PDF, file d'attente comprise
+
+# ----------------------------
+# Mesures
+# ----------------------------
+class Recorder:
+    """Mesures de toutes les sessions (appelé depuis leurs threads) et échantillons de mémoire."""
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.reruns: List[Rerun] = []
+        self.generations: List[Generation] = []
+        self.rss: List[List[float]] = []
+        self._lock = threading.Lock()
+        self._run_lock = threading.Lock()   # one AppTest run at a time, see the module docstring
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self.sample_rss_loop, name="load-test-rss", daemon=True)
+
+    def now(self) -> float:
+        return time.perf_counter() - self.origin
+
+    def timed(self, session: int, action: str, at) -> float:
+        started = self.now()
+        error = ""
+        with self._run_lock:
+            waited = self.now() - started
+            try:
+                at.run()
+                if at.exception:
+                    error = "; ".join(str(e.value) for e in at.exception)
+            except Exception as e: # timeout of AppTest.run, among others
+                error = f"{type(e).__name__}: {e}"
+        seconds = self.now() - started
+        with self._lock:
+            self.reruns.append(Rerun(session, action, round(started, 3), seconds, waited, error))
+        return seconds
+
+    def generation(self, session: int, round_index: int, outcome: str, seconds: float):
+        with self._lock:
+            self.generations.append(Generation(session, round_index, outcome, round(seconds, 3)))
+
+    def sample_rss(self):
+        from flashcard3.profiling import current_rss_mb # imported after main has set XDG_CACHE_HOME
+        rss = current_rss_mb()
+        if rss is not None:
+            self.rss.append([round(self.now(), 2), rss])
+
+    def sample_rss_loop(self):
+        while not self._stop.is_set():
+            self.sample_rss()
+            self._stop.wait(RSS_SAMPLE_SECONDS)
+
+    def start(self):
+        self._sampler.start()
+
+    def stop(self):
+        self._stop.set()
+        self._sampler.join()
+        self.sample_rss()
+
+def generate_button(at):
+    return next(button for button in at.button if button.label == GENERATE_LABEL)
+
+def run_session(
+    index: int, settings: Settings, csv_bytes: bytes, zip_bytes: Optional[bytes],
+    recorder: Recorder, make_app: Callable
+):
+    # Staggered arrivals, as teachers do not all click at the same second
+    time.sleep(settings.ramp_seconds * index / max(1, settings.sessions))
+    at = make_app()
+    recorder.timed(index, "load", at)
+
+    at.file_uploader(key="csv_uploader").set_value((f"paquet{index}.csv", csv_bytes, "text/csv"))
+    if zip_bytes is not None:
+        at.file_uploader(key="images_zip_uploader").set_value((f"images{index}.zip", zip_bytes, "application/zip"))
+    recorder.timed(index, "upload", at)
+    if settings.multi_page:
+        at.checkbox(key="multi_page").check()
+        recorder.timed(index, "option", at)
+
+    styles = at.radio(key="recto_color_style").options
+    for round_index in range(settings.rounds):
+        time.sleep(settings.think_seconds)
+        at.radio(key="recto_color_style").set_value(styles[round_index % len(styles)])
+        recorder.timed(index, "option", at)
+
+        time.sleep(settings.think_seconds)
+        generate_button(at).click()
+        clicked = recorder.now()
+        recorder.timed(index, "generate", at)
+        if "pdf_job" not in at.session_state:
+            # Not queued: RenderServiceBusy is shown with st.error
+            recorder.generation(index, round_index, REFUSED if len(at.error) else ENDED, recorder.now() - clicked)
+            continue
+
+        # The progress fragment reruns on its own in a browser, AppTest needs explicit reruns
+        outcome = TIMED_OUT
+        while recorder.now() - clicked < GENERATION_TIMEOUT_SECONDS:
+            time.sleep(POLL_SECONDS)
+            recorder.timed(index, "poll", at)
+            if "pdf_job" not in at.session_state:
+                outcome = GENERATED if "generated_pdf" in at.session_state else ENDED
+                break
+        recorder.generation(index, round_index, outcome, recorder.now() - clicked)
+
+def summarize(recorder: Recorder, wall_seconds: float) -> Dict:
+    actions = sorted({rerun.action for rerun in recorder.reruns})
+    generated = [g.seconds for g in recorder.generations if g.outcome == GENERATED]
+    outcomes: Dict[str, int] = {}
+    for g in recorder.generations:
+        outcomes[g.outcome] = outcomes.get(g.outcome, 0) + 1
+    rss = [mb for _, mb in recorder.rss]
+    return {
+        "wall_s": round(wall_seconds, 3),
+        "reruns": {
+            "all": percentiles([rerun.seconds for rerun in recorder.reruns]),
+            **{action: percentiles([r.seconds for r in recorder.reruns if r.action == action]) for action in actions},
+        },
+        "rerun_waits": percentiles([rerun.waited for rerun in recorder.reruns]),
+        "rerun_errors": [rerun._asdict() for rerun in recorder.reruns if rerun.error],
+        "generations": {
+            "outcomes": outcomes,
+            "per_minute": round(len(generated) / wall_seconds * 60, 2) if wall_seconds else None,
+            "seconds": percentiles(generated),
+        },
+        "rss_mb": {
+            "start": rss[0] if rss else None,
+            "peak": max(rss) if rss else None,
+            "end": rss[-1] if rss else None,
+            "samples": recorder.rss,
+        },
+    }
+
+def print_summary(summary: Dict):
+    def line(name: str, stats: Dict) -> str:
+        if not stats["count"]:
+            return f"{name:<10} -"
+        return (f"{name:<10} n={stats['count']:<5} p50 {stats['p50']:.3f} s  p95 {stats['p95']:.3f} s  "
+                f"p99 {stats['p99']:.3f} s  max {stats['max']:.3f} s")
+
+    print(f"Durée totale {summary['wall_s']:.1f} s", file=sys.stderr)
+    print("Exécutions du script :", file=sys.stderr)
+    for name, stats in summary["reruns"].items():
+        print("  " + line(name, stats), file=sys.stderr)
+    print("  " + line("attente", summary["rerun_waits"]), file=sys.stderr)
+    generations = summary["generations"]
+    print(
+        "Générations : " + ", ".join(f"{n} {outcome}(s)" for outcome, n in sorted(generations["outcomes"].items()))
+        + f", {generations['per_minute']} PDF/min", file=sys.stderr
+    )
+    print("  " + line("durée", generations["seconds"]), file=sys.stderr)
+    rss = summary["rss_mb"]
+    if rss["peak"] is not None:
+        print(f"Mémoire résidente : {rss['start']} Mo au départ, pic {rss['peak']} Mo, {rss['end']} Mo à la fin",
+              file=sys.stderr)
+    if summary["rerun_errors"]:
+        print(f"{len(summary['rerun_errors'])} exécution(s) en erreur, voir le JSON", file=sys.stderr)
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Test de charge de l'application Streamlit (sessions simulées par AppTest).")
+    parser.add_argument("--sessions", type=int, default=DEFAULT_SESSIONS, help="sessions simultanées")
+    parser.add_argument("--rounds", type=int, default=DEFAULT_ROUNDS, help="générations par session")
+    parser.add_argument("--cards", type=int, default=DEFAULT_CARDS, help="cartes par paquet")
+    parser.add_argument("--scenario", default="png", help="paquet de bench.py : text, png, photo, pc, frame")
+    parser.add_argument("--first-sheet-only", action="store_true", help="ne pas cocher l'option multi-pages")
+    parser.add_argument("--same-deck", action="store_true",
+                        help="même paquet pour toutes les sessions (sinon le texte des cartes diffère par session)")
+    parser.add_argument("--ramp", type=float, default=5.0, help="arrivée des sessions étalée sur ce nombre de secondes")
+    parser.add_argument("--think", type=float, default=THINK_SECONDS, help="pause entre deux actions d'une session (s)")
+    parser.add_argument("--cache-dir", help="XDG_CACHE_HOME des caches disque (défaut : dossier temporaire, caches froids)")
+    parser.add_argument("-o", "--output", help="fichier JSON des résultats")
+    return parser
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+
+    # Set before the app imports flashcard3, which reads it for its disk cache directories
+    cache_home = args.cache_dir or tempfile.mkdtemp(prefix="flashcard3-load-")
+    os.environ["XDG_CACHE_HOME"] = cache_home
+    # The app logs one JSON line per generation unless the logger already has a handler
+    logging.getLogger("flashcard3").addHandler(logging.NullHandler())
+
+    from streamlit.testing.v1 import AppTest
+    # Sessions are driven from plain threads, which Streamlit warns about in bare mode
+    logging.getLogger("streamlit.runtime.scriptrunner_utils.script_run_context").disabled = True
+    from bench import SCENARIOS, git_commit, make_csv, make_zip
+
+    scenario = SCENARIOS[args.scenario]
+    csv_text = make_csv(scenario, args.cards)
+    zip_bytes = make_zip(scenario)
+    settings = Settings(args.sessions, args.rounds, args.ramp, args.think, not args.first_sheet_only, args.same_deck)
+
+    def deck(index: int) -> bytes:
+        if settings.same_deck:
+            return csv_text.encode()
+        # Distinct content per session, so that no session is served from another one's cached PDF
+        return csv_text.replace("Question ", f"Question s{index}-").encode()
+
+    recorder = Recorder()
+    threads = [
+        threading.Thread(
+            target=run_session, name=f"load-test-{i}",
+            args=(i, settings, deck(i), zip_bytes, recorder,
+                  lambda: AppTest.from_file(APP_PATH, default_timeout=RUN_TIMEOUT_SECONDS))
+        )
+        for i in range(settings.sessions)
+    ]
+    recorder.start()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall_seconds = time.perf_counter() - started
+    recorder.stop()
+
+    summary = summarize(recorder, wall_seconds)
+    print_summary(summary)
+    run = {
+        "commit": git_commit(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {**settings._asdict(), "cards": args.cards, "scenario": scenario.name},
+        **summary,
+        "generations_detail": [g._asdict() for g in recorder.generations],
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(run, f, ensure_ascii=False, indent=2)
+    if not args.cache_dir:
+        shutil.rmtree(cache_home, ignore_errors=True)
+
+    failed = summary["rerun_errors"] or any(g.outcome in (ENDED, TIMED_OUT) for g in recorder.generations)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,20 @@
+"""Générateur de cartes recto/verso imprimables (PDF A4), sans dépendance à Streamlit."""
+from .batch import BatchDeck, BatchReport, BatchCancelled, read_decks_zip, build_batch_zip, build_batch_combined
+from .cards import (
+    COLOR_MAP, DEFAULT_BACK_COLOR, DEFAULT_BACK_COLOR_NAME, Card,
+    parse_color_string, pick_color_from_filename, iter_cards_from_csv, read_cards_from_csv,
+)
+from .images import TARGET_DPI, JPEG_QUALITY, ImageHeader, ImageRejected, ZipImageStore
+from .pdf import NB_CARTES, RECTO_STYLES, RECTO_STYLE_FILL, RECTO_STYLE_FRAME, BuildReport, BuildCancelled, CardError, build_pdf
+from .preview import CardPreviewer
+from .render_cache import RenderCache
+from .result_cache import PdfResultCache, deck_key
+
+__all__ = [
+    "BatchDeck", "BatchReport", "BatchCancelled", "read_decks_zip", "build_batch_zip", "build_batch_combined",
+    "COLOR_MAP", "DEFAULT_BACK_COLOR", "DEFAULT_BACK_COLOR_NAME", "Card",
+    "parse_color_string", "pick_color_from_filename", "iter_cards_from_csv", "read_cards_from_csv",
+    "TARGET_DPI", "JPEG_QUALITY", "ImageHeader", "ImageRejected", "ZipImageStore",
+    "NB_CARTES", "RECTO_STYLES", "RECTO_STYLE_FILL", "RECTO_STYLE_FRAME", "BuildReport", "BuildCancelled", "CardError", "build_pdf",
+    "CardPreviewer", "RenderCache", "PdfResultCache", "deck_key",
+]
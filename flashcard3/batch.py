@@ -0,0 +1,334 @@
+"""
+Génération par lots : les paquets CSV d'une archive ZIP, rendus avec une seule archive d'images,
+en un PDF par paquet (réunis dans une archive ZIP) ou en un seul PDF.
+"""
+import os, time, hashlib, zipfile, threading, itertools
+from bisect import bisect_right
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Dict, Tuple, Optional, Callable, Mapping, BinaryIO, NamedTuple
+
+from reportlab.lib import colors
+
+from .cards import Card, iter_cards_from_csv
+from .images import IMAGE_WORKERS, CardImage
+from .jobs import JOB_PENDING, JOB_RUNNING, JOB_DONE, JOB_CANCELLED, JOB_FAILED, expected_card_faces
+from .pdf import NB_CARTES, EMPTY_CARD, PDF_SPOOL_MAX_MEMORY, BuildCancelled, BuildReport, CardError, SpooledPdf, build_pdf
+from .render_service import JOB_BASE_MEMORY, estimate_job_memory
+
+# ----------------------------
+# Réglages
+# ----------------------------
+BATCH_WORKERS = 3                          # paquets rendus en même temps (archive de PDF)
+BATCH_DECKS_AHEAD = 2                      # PDF rendus ou en attente d'écriture dans l'archive, par thread
+MAX_BATCH_DECKS = 100                      # fichiers CSV par archive
+MAX_DECK_CSV_BYTES = 16 * 1024 * 1024      # par fichier CSV, décompressé
+MAX_DECK_CARDS = 50_000                    # lignes de cartes par fichier CSV
+MAX_BATCH_CSV_BYTES = 64 * 1024 * 1024     # total des CSV de l'archive, décompressés
+MAX_BATCH_CARDS = 200_000                  # total des cartes de l'archive
+BATCH_OUTPUT_ZIP = "Une archive ZIP (un PDF par paquet)"
+BATCH_OUTPUT_COMBINED = "Un seul PDF (chaque paquet sur de nouvelles feuilles)"
+BATCH_OUTPUTS = (BATCH_OUTPUT_ZIP, BATCH_OUTPUT_COMBINED)
+
+class BatchDeck(NamedTuple):
+    name: str            # chemin du CSV dans l'archive
+    digest: str          # SHA-256 du CSV, comme pour un fichier envoyé seul
+    cards: List[Card]
+    error: str           # CSV refusé ou illisible, "" sinon
+
+# render_deck(deck, progress, cancel) builds one deck with its caches, as render_pdf does for a single upload;
+# the PDF it returns belongs to the batch, which closes it once copied into the archive
+DeckRenderer = Callable[[BatchDeck, Callable[[BuildReport], None], threading.Event], Tuple[SpooledPdf, BuildReport]]
+
+def read_decks_zip(
+    zip_source,
+    max_decks: int = MAX_BATCH_DECKS,
+    max_csv_bytes: int = MAX_DECK_CSV_BYTES,
+    max_cards: int = MAX_DECK_CARDS,
+    max_total_bytes: int = MAX_BATCH_CSV_BYTES,
+    max_total_cards: int = MAX_BATCH_CARDS
+) -> List[BatchDeck]:
+    """
+    Paquets CSV d'une archive ZIP, par ordre de chemin ; les autres fichiers sont ignorés.
+    Un CSV trop volumineux (octets décompressés ou cartes, pour lui ou pour l'archive entière),
+    illisible ou sans carte est gardé avec son erreur, sans ses cartes (les autres paquets sont
+    rendus). ValueError si l'archive contient plus de `max_decks` CSV.
+    """
+    with zipfile.ZipFile(zip_source) as z:
+        infos = sorted(
+            (info for info in z.infolist()
+             if not info.is_dir() and info.filename.lower().endswith(".csv")
+             and not os.path.basename(info.filename).startswith(".") and not info.filename.startswith("__MACOSX/")),
+            key=lambda info: info.filename
+        )
+        if len(infos) > max_decks:
+            raise ValueError(f"trop de fichiers CSV dans l'archive ({len(infos)}, maximum {max_decks})")
+        decks = []
+        total_bytes = total_cards = 0
+        for info in infos:
+            cards: List[Card] = []
+            digest, error = "", ""
+            if info.file_size > max_csv_bytes:
+                error = f"fichier trop volumineux ({info.file_size / 1e6:.0f} Mo, maximum {max_csv_bytes / 1e6:.0f} Mo)"
+            elif total_bytes + info.file_size > max_total_bytes:
+                error = f"archive trop volumineuse (plus de {max_total_bytes / 1e6:.0f} Mo de CSV)"
+            else:
+                total_bytes += info.file_size
+                data = z.read(info)
+                digest = hashlib.sha256(data).hexdigest()
+                # Parsing stops one card past the limit, whichever of the deck's or the archive's is lower
+                limit = min(max_cards, max_total_cards - total_cards)
+                try:
+                    cards = list(itertools.islice(iter_cards_from_csv(data.decode("utf-8")), limit + 1))
+                except Exception as e:
+                    error = f"CSV illisible ({e})"
+                else:
+                    if not cards:
+                        error = "aucune carte n'a pu être lue"
+                    elif len(cards) > max_cards:
+                        cards = []
+                        error = f"trop de cartes (maximum {max_cards})"
+                    elif len(cards) > limit:
+                        cards = []
+                        error = f"trop de cartes dans l'archive (maximum {max_total_cards})"
+                    total_cards += len(cards)
+            decks.append(BatchDeck(info.filename, digest, cards, error))
+    return decks
+
+def deck_cards(deck: BatchDeck, multi_page: bool) -> List[Card]:
+    return deck.cards if multi_page else deck.cards[:NB_CARTES]
+
+def deck_pdf_name(deck_name: str) -> str:
+    return os.path.splitext(deck_name)[0] + ".pdf"
+
+def batch_card_faces(decks: List[BatchDeck], multi_page: bool) -> int:
+    """Faces de cartes dessinées pour tout le lot (chaque paquet complété à la feuille), pour l'avancement."""
+    return sum(expected_card_faces(len(deck.cards), multi_page) for deck in decks if not deck.error)
+
+def batch_image_workers(workers: int) -> int:
+    # Decks already run in parallel: the image threads are shared out between them
+    return max(1, IMAGE_WORKERS // max(1, workers))
+
+def batch_window(workers: int) -> int:
+    # PDFs rendered or waiting for their turn in the archive: each one may spool PDF_SPOOL_MAX_MEMORY
+    return max(1, workers) * BATCH_DECKS_AHEAD
+
+def estimate_batch_memory(
+    decks: List[BatchDeck],
+    images: Optional[Mapping[str, CardImage]],
+    multi_page: bool,
+    target_dpi: Optional[int],
+    output: str,
+    workers: int = BATCH_WORKERS
+) -> int:
+    """Mémoire de travail estimée du lot (octets), voir estimate_job_memory ; PDF en mémoire compris pour une archive."""
+    cards = [card for deck in decks if not deck.error for card in deck_cards(deck, multi_page)]
+    if output == BATCH_OUTPUT_COMBINED:
+        return estimate_job_memory(cards, images, True, target_dpi)
+    workers = max(1, min(workers, sum(1 for deck in decks if not deck.error)))
+    memory = estimate_job_memory(cards, images, True, target_dpi, batch_image_workers(workers) * workers)
+    return memory + JOB_BASE_MEMORY * (workers - 1) + PDF_SPOOL_MAX_MEMORY * batch_window(workers)
+
+class DeckResult:
+    """État, durée et erreurs d'un paquet du lot."""
+    def __init__(self, deck: BatchDeck):
+        self.name = deck.name
+        self.cards = len(deck.cards)
+        self.state = JOB_FAILED if deck.error else JOB_PENDING
+        self.error = deck.error
+        self.cards_drawn = 0
+        self.sheets = 0
+        self.first_sheet: Optional[int] = None   # un seul PDF : première feuille du paquet (à partir de 0)
+        self.seconds: Optional[float] = None
+        self.errors: List[CardError] = []
+
+class BatchReport:
+    """
+    Résultat d'un lot : un DeckResult par CSV de l'archive. `cards_drawn` et `sheets` cumulent
+    tous les paquets, comme BuildReport pour PdfJob ; `report` est le BuildReport du PDF unique.
+    """
+    def __init__(self, decks: List[DeckResult]):
+        self.decks = decks
+        self.cards_drawn = 0
+        self.sheets = 0
+        self.report: Optional[BuildReport] = None
+
+    @property
+    def errors(self) -> List[CardError]:
+        return [error for deck in self.decks for error in deck.errors]
+
+class BatchCancelled(BuildCancelled):
+    """Lot interrompu par `cancel` : `report` est le BatchReport (paquets terminés, annulés ou en attente)."""
+    def __init__(self, batch: BatchReport):
+        Exception.__init__(self, "Génération du lot annulée.")
+        self.report = batch
+
+def deck_error(error: CardError, first_card: int) -> CardError:
+    """Erreur d'une carte du PDF unique, numérotée dans son paquet."""
+    card = error.card - first_card
+    # Messages name the card by its index in the document
+    message = error.message.replace(f"la carte {error.card}:", f"la carte {card}:")
+    return CardError(card, error.side, message)
+
+def build_batch_zip(
+    decks: List[BatchDeck],
+    render_deck: DeckRenderer,
+    output_buffer: BinaryIO,
+    workers: int = BATCH_WORKERS,
+    progress: Optional[Callable[[BatchReport], None]] = None,
+    cancel: Optional[threading.Event] = None
+) -> BatchReport:
+    """
+    Rend chaque paquet dans son PDF, `workers` paquets à la fois, et l'écrit dans l'archive ZIP
+    (un PDF par CSV, même chemin, dans l'ordre des paquets) dès que son tour vient : au plus
+    batch_window(workers) PDF sont gardés en même temps. Les paquets partagent l'archive d'images
+    et ses images décodées. Un paquet en échec n'arrête pas les autres ; quand `cancel` est levé,
+    les paquets en cours s'arrêtent à la carte suivante, ceux en attente ne démarrent pas et
+    BatchCancelled est levée.
+    """
+    results = [DeckResult(deck) for deck in decks]
+    batch = BatchReport(results)
+    cancel = cancel or threading.Event()
+
+    def on_progress():
+        # Plain attribute writes from several threads: the totals are only used for display
+        batch.cards_drawn = sum(result.cards_drawn for result in results)
+        batch.sheets = sum(result.sheets for result in results)
+        if progress is not None:
+            progress(batch)
+
+    def run(i: int) -> Optional[SpooledPdf]:
+        result = results[i]
+        if cancel.is_set():
+            result.state = JOB_CANCELLED
+            return None
+        result.state = JOB_RUNNING
+        started = time.perf_counter()
+
+        def on_deck_progress(report: BuildReport):
+            result.cards_drawn = report.cards_drawn
+            result.sheets = report.sheets
+            on_progress()
+
+        pdf = None
+        try:
+            pdf, report = render_deck(decks[i], on_deck_progress, cancel)
+            result.sheets = report.sheets
+            result.errors = report.errors
+            result.state = JOB_DONE
+        except BuildCancelled:
+            result.state = JOB_CANCELLED
+        except Exception as e:
+            result.error = str(e)
+            result.state = JOB_FAILED
+        finally:
+            result.seconds = time.perf_counter() - started
+        on_progress()
+        return pdf
+
+    todo = [i for i, deck in enumerate(decks) if not deck.error]
+    window = batch_window(workers)
+    futures: Dict[int, Future] = {}
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="flashcard3-batch") as executor:
+        try:
+            # PDFs are already compressed
+            with zipfile.ZipFile(output_buffer, "w", zipfile.ZIP_STORED) as z:
+                for n, i in enumerate(todo):
+                    for j in todo[n + len(futures):n + window]:
+                        futures[j] = executor.submit(run, j)
+                    pdf = futures.pop(i).result()
+                    if pdf is None:
+                        continue
+                    with z.open(deck_pdf_name(decks[i].name), "w", force_zip64=True) as member:
+                        pdf.copy_to(member)
+                    pdf.close()
+        except BaseException:
+            cancel.set()
+            for future in futures.values():
+                pdf = future.result()
+                if pdf is not None:
+                    pdf.close()
+            raise
+    if cancel.is_set():
+        raise BatchCancelled(batch)
+    return batch
+
+def build_batch_combined(
+    decks: List[BatchDeck],
+    default_back_color: colors.Color,
+    output_buffer: BinaryIO,
+    uploaded_recto_images: Optional[Mapping[str, CardImage]] = None,
+    multi_page: bool = False,
+    progress: Optional[Callable[[BatchReport], None]] = None,
+    cancel: Optional[threading.Event] = None,
+    **options
+) -> BatchReport:
+    """
+    Tous les paquets dans un seul PDF (build_pdf, `options` comprises), chacun commençant sur une
+    nouvelle feuille. Sans `multi_page`, chaque paquet est limité à sa première feuille. Un document
+    ReportLab se dessine d'un bout à l'autre : les paquets sont dessinés à la suite (images traitées
+    en parallèle par build_pdf) et la durée de chaque paquet est mesurée à ses changements de feuille.
+    """
+    results = [DeckResult(deck) for deck in decks]
+    batch = BatchReport(results)
+    drawn: List[DeckResult] = []
+    first_sheets: List[int] = []
+    cards: List = []
+    for result, deck in zip(results, decks):
+        if deck.error:
+            continue
+        used = deck_cards(deck, multi_page)
+        sheets = max(1, -(-len(used) // NB_CARTES))
+        result.first_sheet = len(cards) // NB_CARTES
+        result.sheets = sheets
+        drawn.append(result)
+        first_sheets.append(result.first_sheet)
+        cards.extend(used)
+        cards.extend([EMPTY_CARD] * (sheets * NB_CARTES - len(used)))
+    if not drawn:
+        raise ValueError("aucun paquet valide dans l'archive")
+
+    starts: List[Optional[float]] = [None] * len(drawn)
+    faces_per_sheet = NB_CARTES * 2
+
+    def on_progress(report: BuildReport):
+        current = bisect_right(first_sheets, report.sheets) - 1
+        if starts[current] is None:
+            starts[current] = time.perf_counter()
+        for i, result in enumerate(drawn):
+            first_face = result.first_sheet * faces_per_sheet
+            result.cards_drawn = min(max(0, report.cards_drawn - first_face), result.sheets * faces_per_sheet)
+            result.state = JOB_DONE if i < current else JOB_RUNNING if i == current else JOB_PENDING
+        batch.cards_drawn = report.cards_drawn
+        batch.sheets = report.sheets
+        if progress is not None:
+            progress(batch)
+
+    try:
+        report = build_pdf(
+            cards, default_back_color, output_buffer,
+            uploaded_recto_images=uploaded_recto_images,
+            multi_page=True,
+            progress=on_progress,
+            cancel=cancel,
+            **options
+        )
+    except BuildCancelled:
+        for result in drawn:
+            if result.state != JOB_DONE:
+                result.state = JOB_CANCELLED
+        raise BatchCancelled(batch)
+    finished = time.perf_counter()
+
+    batch.report = report
+    batch.sheets = report.sheets
+    first_cards = [sheet * NB_CARTES for sheet in first_sheets]
+    for error in report.errors:
+        deck = bisect_right(first_cards, error.card) - 1
+        drawn[deck].errors.append(deck_error(error, first_cards[deck]))
+    for i, result in enumerate(drawn):
+        result.state = JOB_DONE
+        result.cards_drawn = result.sheets * faces_per_sheet
+        start = starts[i]
+        end = next((s for s in starts[i + 1:] if s is not None), finished)
+        result.seconds = end - start if start is not None else None
+    return batch
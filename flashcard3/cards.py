@@ -0,0 +1,183 @@
+"""Lecture du CSV des cartes et couleurs du recto."""
+import re, csv, io, itertools
+from functools import lru_cache
+from typing import List, Dict, Tuple, Iterator, Optional, NamedTuple
+
+from reportlab.lib import colors
+
+from .profiling import Profiler, stage
+
+# Couleurs (recto)
+DEFAULT_BACK_COLOR_NAME = "gris"
+DEFAULT_BACK_COLOR = colors.HexColor("#B3B3B3")
+COLOR_MAP = {
+    "bleu": colors.HexColor("#2D6CDF"),
+    "rouge": colors.HexColor("#D64541"),
+    "rose": colors.HexColor("#E85D9E"),
+    "vert": colors.HexColor("#2ECC71"),
+    "jaune": colors.HexColor("#F1C40F"),
+    "blanc": colors.white, # Ajout du blanc
+    "gris": DEFAULT_BACK_COLOR
+}
+# Couleurs déjà analysées (chaînes de couleur distinctes du paquet)
+PARSED_COLORS_CACHE_SIZE = 1024
+
+# Colonnes reconnues dans l'en-tête (après normalize_header)
+HEADER_NAMES = frozenset((
+    "question", "q", "texte", "text", "reponse", "réponse", "answer", "reponseverso", "verso",
+    "image_recto", "imagerecto", "image_verso", "imageverso"
+))
+QUESTION_KEYS = ("question", "q")
+TEXT_KEYS = ("texte", "text", "reponse", "réponse", "answer", "verso", "reponseverso")
+IMAGE_RECTO_KEYS = ("image_recto", "imagerecto")
+IMAGE_VERSO_KEYS = ("image_verso", "imageverso")
+
+HEX_COLOR_RE = re.compile(r'^#?([0-9a-fA-F]{3}(?:[0-9a-fA-F]{3})?)$')
+# (couleur_ou_#CODEHEX) at the beginning or at the end of the question
+COLOR_PREFIX_RE = re.compile(r'^\s*\(([^)]+)\)\s*(.*)$', re.IGNORECASE)
+COLOR_SUFFIX_RE = re.compile(r'\s*\(([^)]+)\)\s*$', re.IGNORECASE)
+WHITESPACE_RE = re.compile(r"\s+")
+
+class Card(NamedTuple):
+    """Une carte lue depuis le CSV (tuple compact, lisible comme le dict d'origine avec `get`)."""
+    question: str
+    texte: str
+    card_color_key: Optional[str]
+    image_recto: str
+    image_verso: str
+
+    def get(self, key: str, default=None):
+        return getattr(self, key) if key in self._fields else default
+
+def pick_color_from_filename(filename: str) -> Tuple[str, colors.Color]:
+    return DEFAULT_BACK_COLOR_NAME, DEFAULT_BACK_COLOR
+
+@lru_cache(maxsize=PARSED_COLORS_CACHE_SIZE)
+def parse_color_string(color_str: str, default_color: colors.Color) -> colors.Color:
+    if not color_str:
+        return default_color
+
+    # Try to match predefined color names
+    if color_str.lower() in COLOR_MAP:
+        return COLOR_MAP[color_str.lower()]
+
+    # Try to match hexadecimal color codes (3 or 6 digits)
+    hex_match = HEX_COLOR_RE.match(color_str.strip())
+    if hex_match:
+        # Ensure it's a 6-digit hex code for ReportLab
+        hex_code_val = hex_match.group(1)
+        if len(hex_code_val) == 3:
+            hex_code_val = ''.join([c*2 for c in hex_code_val]) # Expand 3-digit to 6-digit
+        hex_code = "#" + hex_code_val
+        try:
+            return colors.HexColor(hex_code)
+        except Exception:
+            # Fallback if HexColor parsing fails
+            pass
+
+    # If neither, return default color
+    return default_color
+
+def is_dark(c: colors.Color) -> bool:
+    r, g, b = c.red, c.green, c.blue
+    # For white, we need to explicitly return false for dark to ensure black text
+    if c == colors.white:
+        return False
+    lum = 0.2126*r + 0.7152*g + 0.0722*b
+    return lum < 0.55
+
+def sniff_dialect(data: str) -> csv.Dialect:
+    # Priority to semicolon if it seems like the primary delimiter
+    if ';' in data:
+        try:
+            # Check if semicolon works as a reasonable delimiter (e.g., more than one field)
+            # and if it appears consistently enough to be the primary delimiter
+            f_test = io.StringIO(data)
+            test_reader = csv.reader(f_test, delimiter=';')
+            # Look at first few lines to guess consistency
+            sample_lines = data.splitlines()[:5]
+            if any(len(row) > 1 for row in csv.reader(io.StringIO(sample_lines[0]), delimiter=';')) or all(';' in line for line in sample_lines if line.strip()):
+                class SemicolonDialect(csv.excel):
+                    delimiter = ';'
+                return SemicolonDialect()
+        except Exception:
+            pass # Fall through to other options
+
+    # Then try to sniff more generally
+    sniffer = csv.Sniffer()
+    try:
+        # Sniff using common delimiters, excluding semicolon since we handled it
+        dialect = sniffer.sniff(data[:4096], delimiters=',\t')
+        return dialect
+    except csv.Error:
+        # If sniffing fails (e.g., single column data or unusual format),
+        # return excel dialect as a robust default (usually comma-delimited)
+        return csv.get_dialect('excel')
+
+def normalize_header(h: str) -> str:
+    return WHITESPACE_RE.sub("", (h or "").strip().lower())
+
+def split_color(q_raw: str) -> Tuple[Optional[str], str]:
+    """Sépare la couleur (couleur_ou_#CODEHEX) de la question : (couleur ou None, question)."""
+    # Try to find (color_name_or_hex) at the BEGINNING of the string
+    match_beginning = COLOR_PREFIX_RE.match(q_raw)
+    if match_beginning:
+        return match_beginning.group(1).strip(), match_beginning.group(2).strip()
+    # If not at the beginning, try to find (color_name_or_hex) at the END of the string
+    match_end = COLOR_SUFFIX_RE.search(q_raw)
+    if match_end:
+        return match_end.group(1).strip(), (q_raw[:match_end.start()] + q_raw[match_end.end():]).strip()
+    return None, q_raw
+
+def iter_cards_from_csv(csv_file_content: str, profile: Optional[Profiler] = None) -> Iterator[Card]:
+    """
+    CSV attendu (souple) :
+    - question : colonne 'question' (ou 1re colonne si pas d'en-tête)
+    - texte verso : colonne 'texte' / 'reponse' / 'réponse' / 'answer' (ou 2e/3e colonne selon présence d'en-tête)
+    - image recto : colonne 'image_recto' / 'imagerecto' (ou 3e colonne si pas d'en-tête)
+    - image verso : colonne 'image_verso' / 'imageverso' (ou 4e colonne si pas d'en-tête)
+    Les lignes sont lues au fur et à mesure : les cartes sont produites sans matérialiser le fichier.
+    """
+    with stage(profile, "sniff_dialect"):
+        dialect = sniff_dialect(csv_file_content)
+    reader = csv.reader(io.StringIO(csv_file_content), dialect)
+    first = next(reader, None)
+    if first is None:
+        return
+
+    norm_first = [normalize_header(x) for x in first]
+    has_header = any(x in HEADER_NAMES for x in norm_first)
+
+    if has_header:
+        # Column of each field resolved once: first matching key, last column with that header
+        positions = {header: i for i, header in enumerate(norm_first)}
+        def column(keys: Tuple[str, ...]) -> Optional[int]:
+            for k in keys:
+                if normalize_header(k) in positions:
+                    return positions[normalize_header(k)]
+            return None
+        columns = [column(QUESTION_KEYS), column(TEXT_KEYS), column(IMAGE_RECTO_KEYS), column(IMAGE_VERSO_KEYS)]
+        rows = reader
+    else:
+        # Sans en-tête : col1=question, col2=texte, col3=image_recto, col4=image_verso
+        columns = [0, 1, 2, 3]
+        rows = itertools.chain((first,), reader)
+
+    q_col, text_col, recto_col, verso_col = columns
+    for r in rows:
+        if not any(x.strip() for x in r):
+            continue
+        n = len(r)
+        q_raw = r[q_col].strip() if q_col is not None and q_col < n else ""
+        card_color_string, question_text = split_color(q_raw)
+        yield Card(
+            question_text,
+            r[text_col].strip() if text_col is not None and text_col < n else "",
+            card_color_string,
+            r[recto_col].strip() if recto_col is not None and recto_col < n else "",
+            r[verso_col].strip() if verso_col is not None and verso_col < n else ""
+        )
+
+def read_cards_from_csv(csv_file_content: str) -> List[Dict[str, str]]:
+    """Même lecture que iter_cards_from_csv, chaque carte sous forme de dict."""
+    return [card._asdict() for card in iter_cards_from_csv(csv_file_content)]
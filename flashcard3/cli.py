@@ -0,0 +1,214 @@
+"""
+Rendu sans interface, pour les traitements par lots :
+
+    python -m flashcard3 render decks/*.csv --images assets.zip -o out/ --jobs 4
+
+Chaque paquet est rendu dans un processus du pool ; les erreurs par carte sont
+renvoyées comme données (texte ou --json) au lieu d'être affichées dans Streamlit.
+"""
+import argparse, glob, json, os, sys, time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List, Dict, Optional, NamedTuple
+
+from .cards import pick_color_from_filename, iter_cards_from_csv
+from .disk_cache import CACHE_ROOT, DISK_CACHE_BYTES, DiskImageCache
+from .images import TARGET_DPI, IMAGE_WORKERS, ZipImageStore
+from .pdf import RECTO_STYLE_FILL, RECTO_STYLE_FRAME, build_pdf
+from .result_cache import PDF_CACHE_BYTES, PdfResultCache, deck_key
+
+RECTO_STYLE_OPTIONS = {"fill": RECTO_STYLE_FILL, "frame": RECTO_STYLE_FRAME}
+
+class RenderJob(NamedTuple):
+    csv_path: str
+    output_path: str
+    images_path: Optional[str]
+    recto_color_style: str
+    multi_page: bool
+    target_dpi: Optional[int]
+    jpeg_quality: Optional[int]
+    image_workers: int
+    page_compression: bool
+    image_soft_mask: bool
+    reproducible: bool
+    cache_dir: Optional[str]       # caches disque des images traitées et des PDF, None : désactivés
+    cache_bytes: int
+
+def render_deck(job: RenderJob) -> Dict:
+    """Rend un paquet vers son PDF. Exécuté dans un processus du pool : le résultat est un dict sérialisable."""
+    started = time.perf_counter()
+    result = {"deck": job.csv_path, "output": job.output_path, "ok": False, "errors": []}
+    images = None
+    try:
+        with open(job.csv_path, "rb") as f:
+            cards = list(iter_cards_from_csv(f.read().decode("utf-8")))
+        if not cards:
+            raise ValueError("aucune carte n'a pu être lue depuis le fichier CSV")
+        _, default_back_color = pick_color_from_filename(os.path.basename(job.csv_path))
+        if job.images_path:
+            images = ZipImageStore(job.images_path)
+        disk_cache = result_cache = None
+        if job.cache_dir:
+            try:
+                # One cache object per process, the directory itself is shared safely
+                disk_cache = DiskImageCache(os.path.join(job.cache_dir, "images"), job.cache_bytes)
+                result_cache = PdfResultCache(os.path.join(job.cache_dir, "pdfs"), PDF_CACHE_BYTES)
+            except OSError: # e.g. read-only home directory: render without the caches
+                pass
+
+        options = dict(
+            recto_color_style=job.recto_color_style,
+            multi_page=job.multi_page,
+            target_dpi=job.target_dpi,
+            jpeg_quality=job.jpeg_quality,
+            page_compression=job.page_compression,
+            image_soft_mask=job.image_soft_mask
+        )
+        key = report = None
+        # Written beside the target and moved into place once complete: a failed or interrupted
+        # build leaves any previous output untouched
+        tmp_path = f"{job.output_path}.{os.getpid()}.tmp"
+        try:
+            with os.fdopen(os.open(tmp_path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o666), "w+b") as output:
+                if result_cache is not None:
+                    key = deck_key(cards, default_back_color, images, **options)
+                    report = result_cache.get(key, output)
+                if report is None:
+                    report = build_pdf(
+                        cards,
+                        default_back_color,
+                        output,
+                        uploaded_recto_images=images,
+                        image_workers=job.image_workers,
+                        disk_cache=disk_cache,
+                        # Cached PDFs must not depend on when they were built
+                        reproducible=job.reproducible or result_cache is not None,
+                        **options
+                    )
+                    if result_cache is not None:
+                        try:
+                            result_cache.put(key, output, report)
+                        except OSError: # disk full: the PDF itself is fine
+                            pass
+                else:
+                    result["cached"] = True
+            os.replace(tmp_path, job.output_path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        result.update(
+            ok=True,
+            cards=len(cards),
+            sheets=report.sheets,
+            images_embedded=report.images_embedded,
+            image_bytes_embedded=report.image_bytes_embedded,
+            errors=[error._asdict() for error in report.errors],
+            profile=report.profile.as_dict()
+        )
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    finally:
+        if images is not None:
+            images.close()
+    result["seconds"] = round(time.perf_counter() - started, 3)
+    return result
+
+def expand_paths(patterns: List[str]) -> List[str]:
+    # The shell usually expands globs already, not on every platform though
+    paths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern))
+        paths.extend(matches or [pattern])
+    return paths
+
+def render_decks(jobs: List[RenderJob], workers: int) -> List[Dict]:
+    if workers <= 1 or len(jobs) <= 1:
+        return [render_deck(job) for job in jobs]
+
+    results: Dict[str, Dict] = {}
+    with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as executor:
+        futures = [executor.submit(render_deck, job) for job in jobs]
+        for future in as_completed(futures):
+            result = future.result()
+            results[result["deck"]] = result
+    return [results[job.csv_path] for job in jobs]
+
+def format_result(result: Dict) -> str:
+    if not result["ok"]:
+        return f"ÉCHEC {result['deck']} : {result['error']}"
+    return (
+        f"OK    {result['deck']} -> {result['output']} "
+        f"({result['cards']} cartes, {result['sheets']} feuille(s), {result['seconds']:.2f} s"
+        f"{', en cache' if result.get('cached') else ''})"
+    )
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m flashcard3", description="Générateur de cartes recto/verso (PDF A4).")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    render = commands.add_parser("render", help="rendre un ou plusieurs fichiers CSV en PDF")
+    render.add_argument("decks", nargs="+", help="fichiers CSV (motifs glob acceptés)")
+    render.add_argument("--images", help="archive ZIP d'images PNG/JPG partagée par tous les paquets")
+    render.add_argument("-o", "--output-dir", default=".", help="dossier des PDF générés (défaut : dossier courant)")
+    render.add_argument("--style", choices=sorted(RECTO_STYLE_OPTIONS), default="fill", help="style du recto (défaut : fill)")
+    render.add_argument("--first-sheet-only", action="store_true", help="ne garder que les 9 premières cartes, comme l'application")
+    render.add_argument("--dpi", type=int, default=TARGET_DPI, help=f"résolution des images, 0 = pleine résolution (défaut : {TARGET_DPI})")
+    render.add_argument("--jpeg-quality", type=int, help="ré-encoder les images opaques en JPEG à cette qualité")
+    render.add_argument("--no-page-compression", action="store_true", help="ne pas compresser le contenu des pages")
+    render.add_argument("--soft-mask", action="store_true",
+                        help="intégrer la transparence des images comme masque PDF, sans composer sur la couleur des cartes")
+    render.add_argument("--reproducible", action="store_true",
+                        help="PDF identique octet pour octet d'une exécution à l'autre (toujours le cas avec le cache)")
+    render.add_argument("--cache-dir", default=CACHE_ROOT,
+                        help=f"caches disque des images traitées et des PDF (défaut : {CACHE_ROOT})")
+    render.add_argument("--cache-size", type=int, default=DISK_CACHE_BYTES // 1024 ** 2, help="taille maximale du cache des images en Mo")
+    render.add_argument("--no-cache", action="store_true", help="ne pas utiliser les caches disque")
+    render.add_argument("-j", "--jobs", type=int, default=1, help="nombre de paquets rendus en parallèle (processus)")
+    render.add_argument("--json", action="store_true", help="écrire les résultats en JSON sur la sortie standard")
+    return parser
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+
+    decks = expand_paths(args.decks)
+    os.makedirs(args.output_dir, exist_ok=True)
+    jobs = []
+    outputs = set()
+    for csv_path in decks:
+        output_path = os.path.join(args.output_dir, os.path.splitext(os.path.basename(csv_path))[0] + ".pdf")
+        if output_path in outputs:
+            print(f"Plusieurs paquets produiraient {output_path}, renommez-les.", file=sys.stderr)
+            return 2
+        outputs.add(output_path)
+        jobs.append(RenderJob(
+            csv_path=csv_path,
+            output_path=output_path,
+            images_path=args.images,
+            recto_color_style=RECTO_STYLE_OPTIONS[args.style],
+            multi_page=not args.first_sheet_only,
+            target_dpi=args.dpi or None,
+            jpeg_quality=args.jpeg_quality,
+            # Decks already run in parallel processes: no image threads on top of that
+            image_workers=IMAGE_WORKERS if args.jobs <= 1 else 1,
+            page_compression=not args.no_page_compression,
+            image_soft_mask=args.soft_mask,
+            reproducible=args.reproducible,
+            cache_dir=None if args.no_cache else args.cache_dir,
+            cache_bytes=args.cache_size * 1024 ** 2
+        ))
+
+    results = render_decks(jobs, args.jobs)
+
+    if args.json:
+        json.dump(results, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+    else:
+        for result in results:
+            print(format_result(result), file=sys.stdout if result["ok"] else sys.stderr)
+            for error in result["errors"]:
+                print(f"      carte {error['card']} ({error['side']}) : {error['message']}", file=sys.stderr)
+
+    failed = any(not result["ok"] or result["errors"] for result in results)
+    return 1 if failed else 0
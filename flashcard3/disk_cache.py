@@ -0,0 +1,187 @@
+"""Caches disque (images traitées, PDF générés), partagés entre exécutions et entre processus."""
+import os, io, json, time, zlib, shutil, struct, hashlib, tempfile, threading
+from functools import lru_cache
+from typing import BinaryIO, Dict, List, Tuple, Union, Optional, Hashable
+
+from PIL import Image
+from reportlab.lib.utils import ImageReader
+
+from .images import ProcessedImage
+
+# ----------------------------
+# Réglages
+# ----------------------------
+CACHE_ROOT = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"), "flashcard3"
+)
+DISK_CACHE_DIR = os.path.join(CACHE_ROOT, "images")
+DISK_CACHE_BYTES = 2 * 1024 * 1024 * 1024     # au-delà, les entrées les moins récemment utilisées sont supprimées
+DISK_CACHE_EVICT_TO = 0.9                      # fraction du budget gardée après un nettoyage
+STALE_TEMP_SECONDS = 3600                      # fichiers temporaires d'une écriture interrompue
+CACHE_FORMAT = b"FC3IMG1\n"                    # en-tête des entrées ; la version du code fait partie des clés
+
+@lru_cache(maxsize=1)
+def code_digest() -> str:
+    """Empreinte des sources du paquet : une autre version ne reprend pas les entrées de la précédente."""
+    h = hashlib.sha1()
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    for name in sorted(os.listdir(package_dir)):
+        if name.endswith(".py"):
+            with open(os.path.join(package_dir, name), "rb") as f:
+                h.update(name.encode() + b"\0" + f.read())
+    return h.hexdigest()
+
+class DiskCache:
+    """
+    Entrées (un en-tête JSON puis des données) dans un répertoire, une par clé. Les écritures sont
+    atomiques (fichier temporaire puis os.replace), plusieurs processus peuvent partager le répertoire ;
+    la date de modification sert d'horodatage LRU et le répertoire est ramené sous `max_bytes` en
+    supprimant les entrées les plus anciennes.
+    """
+    format = CACHE_FORMAT      # en tête de chaque entrée, change aussi les noms de fichiers
+    suffix = ".img"
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._bytes: Optional[int] = None   # estimation, recalculée à chaque nettoyage
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key: Hashable) -> str:
+        name = hashlib.sha1(self.format + repr(key).encode()).hexdigest()
+        return os.path.join(self.directory, name[:2], name + self.suffix)
+
+    def open_entry(self, key: Hashable) -> Optional[Tuple[Dict, BinaryIO]]:
+        """En-tête et fichier placé au début des données (à fermer), None si l'entrée manque ou est illisible."""
+        path = self.path(key)
+        try:
+            f = open(path, "rb")
+        except OSError: # missing, or evicted by another process meanwhile
+            return None
+        try:
+            if f.read(len(self.format)) != self.format:
+                raise ValueError("format de cache inconnu")
+            (header_len,) = struct.unpack(">I", f.read(4))
+            header = json.loads(f.read(header_len))
+        except Exception: # truncated or from another version: treated as a miss, rewritten later
+            f.close()
+            return None
+        try:
+            os.utime(path) # most recently used
+        except OSError: # read-only cache: still a hit, only the LRU order is not updated
+            pass
+        return header, f
+
+    def write_entry(self, key: Hashable, header: Dict, payload: Union[bytes, BinaryIO]):
+        """`payload` : données ou fichier lu depuis sa position courante."""
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                header_bytes = json.dumps(header).encode()
+                f.write(self.format + struct.pack(">I", len(header_bytes)) + header_bytes)
+                if isinstance(payload, bytes):
+                    f.write(payload)
+                else:
+                    shutil.copyfileobj(payload, f)
+                size = f.tell()
+            os.replace(tmp_path, path) # readers see the old entry or the complete new one
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        with self._lock:
+            if self._bytes is not None:
+                self._bytes += size
+            if self._bytes is None or self._bytes > self.max_bytes:
+                self.evict()
+
+    def entries(self) -> List[Tuple[float, int, str]]:
+        found = []
+        now = time.time()
+        for shard in os.scandir(self.directory):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                try:
+                    st = entry.stat()
+                    if entry.name.endswith(".tmp"):
+                        if now - st.st_mtime > STALE_TEMP_SECONDS:
+                            os.remove(entry.path)
+                        continue
+                except OSError:
+                    continue
+                found.append((st.st_mtime, st.st_size, entry.path))
+        return found
+
+    def evict(self):
+        # Another process may be evicting too: entries already removed are skipped
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        if total > self.max_bytes:
+            target = self.max_bytes * DISK_CACHE_EVICT_TO
+            for _, size, path in sorted(entries):
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                total -= size
+        self._bytes = total
+
+    def clear(self):
+        for _, _, path in self.entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        with self._lock:
+            self._bytes = 0
+
+class DiskImageCache(DiskCache):
+    """
+    Images traitées (pixels ou JPEG prêts à intégrer), indexées par l'empreinte de la source
+    (CRC32, taille et nom du fichier dans le ZIP, rien à décompresser), les paramètres de traitement
+    et la version du code, comme PdfResultCache.
+    """
+    def __init__(self, directory: str = DISK_CACHE_DIR, max_bytes: int = DISK_CACHE_BYTES):
+        super().__init__(directory, max_bytes)
+
+    def get(self, key: Hashable) -> Optional[ProcessedImage]:
+        entry = self.open_entry((code_digest(), key))
+        if entry is None:
+            return None
+        header, f = entry
+        try:
+            with f:
+                return self.decode(header, f.read())
+        except Exception: # truncated or damaged payload: treated as a miss
+            return None
+
+    def put(self, key: Hashable, result: ProcessedImage, pixels: Optional[Image.Image] = None):
+        """`pixels` : image traitée, nécessaire quand le résultat n'est pas un JPEG."""
+        header = {"size": list(result.size), "use_jpeg": result.use_jpeg, "flate_len": result.flate_len}
+        if result.use_jpeg:
+            payload = result.jpeg_data
+        else:
+            header["mode"] = pixels.mode
+            payload = zlib.compress(pixels.tobytes(), 1)
+        self.write_entry((code_digest(), key), header, payload)
+
+    def decode(self, header: Dict, payload: bytes) -> ProcessedImage:
+        size = tuple(header["size"])
+        if header["use_jpeg"]:
+            # Checked here so that a damaged entry is a miss rather than a broken image in the PDF
+            with Image.open(io.BytesIO(payload)) as img:
+                if img.format != "JPEG" or img.size != size or not payload.endswith(b"\xff\xd9"):
+                    raise ValueError("JPEG invalide dans le cache")
+            return ProcessedImage(None, payload, size, True, header["flate_len"])
+        img = Image.frombytes(header["mode"], size, zlib.decompress(payload))
+        reader = ImageReader(img)
+        reader.getRGBData()
+        return ProcessedImage(reader, None, size, False, header["flate_len"])
@@ -0,0 +1,516 @@
+"""Images des cartes : lecture paresseuse depuis le ZIP, traitement et intégration dans le PDF."""
+import os, io, zipfile, hashlib, zlib, threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Set, Tuple, Optional, NamedTuple, Union, Mapping, TYPE_CHECKING
+
+from reportlab.pdfgen import canvas
+from reportlab.lib.units import inch
+from reportlab.lib import colors
+from reportlab.lib.utils import ImageReader
+from PIL import Image, ImageOps
+
+if TYPE_CHECKING:
+    from .pdf import BuildReport
+    from .disk_cache import DiskImageCache
+    from .render_cache import RenderCache
+
+# ----------------------------
+# Réglages
+# ----------------------------
+# Résolution cible à l'impression (None = pleine résolution) et qualité JPEG (None = pas de ré-encodage)
+TARGET_DPI = 300
+JPEG_QUALITY = 85
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+DECODED_IMAGES_CACHE_SIZE = 4   # images décodées gardées en mémoire par archive ZIP
+# Limites de l'archive ZIP, vérifiées sur les métadonnées et les en-têtes avant tout décodage
+MAX_IMAGE_PIXELS = 60_000_000                  # 60 Mpx, au-delà l'image est refusée
+MAX_IMAGE_BYTES = 64 * 1024 * 1024             # taille d'un fichier image une fois décompressé du ZIP
+MAX_ZIP_IMAGES_BYTES = 1024 * 1024 * 1024      # total des images de l'archive, décompressées
+EXIF_ORIENTATION = 0x0112
+ALPHA_MODES = ("RGBA", "LA", "PA", "RGBa", "La")
+IMAGE_WORKERS = min(4, os.cpu_count() or 1)   # threads de traitement des images (1 = pas de pool)
+
+def color_to_rgb_tuple(color: colors.Color) -> Tuple[int, int, int]:
+    return (int(color.red * 255), int(color.green * 255), int(color.blue * 255))
+
+def processed_image_size(img: "CardImage", full_card: bool) -> Tuple[int, int]:
+    w, h = img.size
+    if full_card:
+        # Whatever the EXIF orientation, 'pc_' images end up in portrait
+        return (min(w, h), max(w, h))
+    return (w, h)
+
+def prepare_card_image(
+    img: Image.Image,
+    bg_color_tuple: Optional[Tuple[int, int, int]],
+    full_card: bool,
+    target_size: Optional[Tuple[int, int]] = None
+) -> Image.Image:
+    # Without background colour, transparency is kept for a PDF soft mask (see ImageCache)
+    # 'pc_' images are normalized (EXIF) and turned to portrait before compositing
+    if full_card:
+        img = ImageOps.exif_transpose(img)
+        if img.size[1] < img.size[0]:
+            img = img.rotate(-90, expand=True)
+
+    # Downsample before compositing so that only the final pixels are flattened
+    if target_size:
+        img = img.resize(target_size, Image.LANCZOS, reducing_gap=3.0)
+
+    if bg_color_tuple is None:
+        return img
+
+    # Create a new RGB image with the desired background color, the image is its own mask
+    alpha_composite_img = Image.new('RGB', img.size, bg_color_tuple)
+    alpha_composite_img.paste(img, (0, 0), img)
+    return alpha_composite_img
+
+class ImageRejected(ValueError):
+    """Image de l'archive refusée avant décodage (limites de taille, en-tête illisible)."""
+
+class ImageHeader(NamedTuple):
+    format: str          # "PNG", "JPEG"...
+    width: int
+    height: int
+    mode: str            # mode PIL des pixels une fois décodés
+    orientation: int     # orientation EXIF (1 = aucune rotation)
+    has_alpha: bool
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        return (self.width, self.height)
+
+def read_image_header(fp) -> ImageHeader:
+    # Image.open only parses the header, no pixel is decoded here
+    with Image.open(fp) as im:
+        orientation = 1
+        if "exif" in im.info: # set by the header parser; getexif() may load a PNG's pixels
+            exif = Image.Exif()
+            exif.load(im.info["exif"])
+            orientation = exif.get(EXIF_ORIENTATION, 1)
+        has_alpha = im.mode in ALPHA_MODES or "transparency" in im.info
+        return ImageHeader(im.format or "", im.size[0], im.size[1], im.mode, orientation, has_alpha)
+
+class ZipImage:
+    """
+    Image d'une archive ZIP décrite par son en-tête (manifeste de l'archive) : taille, format et
+    transparence sont connus sans décoder les pixels, qui ne le sont qu'à la demande.
+    Une image refusée par les limites de l'archive lève ImageRejected dès qu'on lit sa taille.
+    """
+    def __init__(self, store: "ZipImageStore", info: zipfile.ZipInfo, header: Optional[ImageHeader], rejected: str = ""):
+        self.store = store
+        self.info = info
+        self.header = header
+        self.rejected = rejected
+        self.digest = f"zip:{info.CRC:08x}:{info.file_size}:{info.filename}"
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        if self.rejected:
+            raise ImageRejected(self.rejected)
+        return self.header.size
+
+    def open_image(self, min_size: Optional[Tuple[int, int]] = None) -> Image.Image:
+        if self.rejected:
+            raise ImageRejected(self.rejected)
+        return self.store.decode(self, min_size)
+
+class ZipImageStore(Mapping):
+    """
+    Images PNG/JPG d'une archive ZIP, indexées par nom de fichier, sans extraction sur disque.
+    À l'ouverture, seuls la liste des fichiers et les en-têtes des images sont lus (manifeste) ;
+    les fichiers au-delà des limites (octets, pixels) sont refusés avant tout
+    décodage et listés dans `rejected`. Les cartes désignent les images par leur seul nom : un
+    fichier portant le nom d'une image déjà trouvée dans un autre dossier y est aussi signalé (sous
+    son chemin dans l'archive), puis ignoré. Une image est décodée quand build_pdf la dessine, en
+    taille réduite pour les JPEG (Image.draft) quand la taille cible le permet.
+    """
+    def __init__(
+        self,
+        zip_source,
+        max_image_pixels: int = MAX_IMAGE_PIXELS,
+        max_image_bytes: int = MAX_IMAGE_BYTES,
+        max_total_bytes: int = MAX_ZIP_IMAGES_BYTES
+    ):
+        self.zip_file = zipfile.ZipFile(zip_source, 'r')
+        self._images: Dict[str, ZipImage] = {}
+        self.rejected: Dict[str, str] = {}   # nom de fichier (chemin pour un doublon) -> raison du refus
+        self._decoded: "OrderedDict[Tuple, Image.Image]" = OrderedDict()
+        self._lock = threading.Lock() # the store may be shared between sessions
+        total_bytes = 0
+        for info in self.zip_file.infolist():
+            filename = os.path.basename(info.filename)
+            if info.is_dir() or filename.startswith(".") or info.filename.startswith("__MACOSX/"):
+                continue
+            if not filename.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            if filename in self._images:
+                kept = self._images[filename].info.filename
+                self.rejected[info.filename] = f"Image {info.filename} ignorée : même nom de fichier que {kept}"
+                continue
+            header, rejected = None, ""
+            if info.file_size > max_image_bytes:
+                rejected = f"fichier trop volumineux ({info.file_size / 1e6:.0f} Mo, maximum {max_image_bytes / 1e6:.0f} Mo)"
+            elif total_bytes + info.file_size > max_total_bytes:
+                rejected = f"archive trop volumineuse (plus de {max_total_bytes / 1e6:.0f} Mo d'images)"
+            else:
+                total_bytes += info.file_size
+                try:
+                    with self.zip_file.open(info) as member:
+                        header = read_image_header(member)
+                except Image.DecompressionBombError:
+                    rejected = f"image trop grande (maximum {max_image_pixels / 1e6:.0f} Mpx)"
+                except Exception as e:
+                    rejected = f"en-tête illisible ({e})"
+                else:
+                    if header.width * header.height > max_image_pixels:
+                        rejected = (f"image trop grande ({header.width} x {header.height} pixels, "
+                                    f"maximum {max_image_pixels / 1e6:.0f} Mpx)")
+            if rejected:
+                rejected = f"Image {filename} refusée : {rejected}"
+                self.rejected[filename] = rejected
+            self._images[filename] = ZipImage(self, info, header, rejected)
+
+    def __getitem__(self, filename: str) -> ZipImage:
+        return self._images[filename]
+
+    def __iter__(self):
+        return iter(self._images)
+
+    def __len__(self) -> int:
+        return len(self._images)
+
+    def decode(self, image: ZipImage, min_size: Optional[Tuple[int, int]] = None) -> Image.Image:
+        key = (image.info.filename, min_size)
+        with self._lock:
+            img = self._decoded.get(key)
+            if img is not None:
+                self._decoded.move_to_end(key)
+                return img
+
+        with self.zip_file.open(image.info) as member:
+            img = Image.open(io.BytesIO(member.read()))
+        if min_size and image.header.format == "JPEG":
+            # DCT scaling: decodes at 1/2, 1/4 or 1/8 while staying >= min_size
+            img.draft("RGB", min_size)
+        img = img.convert('RGBA') # Convert to RGBA for consistent handling
+
+        with self._lock:
+            self._decoded[key] = img
+            if len(self._decoded) > DECODED_IMAGES_CACHE_SIZE:
+                self._decoded.popitem(last=False)
+        return img
+
+    def close(self):
+        self._decoded.clear()
+        self.zip_file.close()
+
+CardImage = Union[Image.Image, ZipImage]
+
+def has_alpha(img: CardImage) -> bool:
+    # From the manifest for a ZIP image: no pixel is decoded
+    if isinstance(img, ZipImage):
+        return img.header.has_alpha
+    return img.mode in ALPHA_MODES or "transparency" in img.info
+
+def image_digest(img: CardImage) -> str:
+    """Empreinte du contenu d'une image : celle du manifeste pour le ZIP, un hachage des pixels sinon."""
+    if isinstance(img, ZipImage):
+        return img.digest # CRC32 of the ZIP member, nothing to decode
+    h = hashlib.sha1(f"{img.mode}{img.size}".encode())
+    h.update(img.tobytes())
+    return h.hexdigest()
+
+class PreparedImage(NamedTuple):
+    name: str      # nom du XObject partagé dans le PDF
+    width: int     # dimensions en pixels après traitement
+    height: int
+
+class ImageJob(NamedTuple):
+    prepared: PreparedImage
+    img: CardImage
+    digest: str
+    bg_color_tuple: Optional[Tuple[int, int, int]]   # None : transparence gardée (masque PDF)
+    full_card: bool
+    target_size: Optional[Tuple[int, int]]
+    src_size: Tuple[int, int]
+
+class ProcessedImage(NamedTuple):
+    reader: Optional[ImageReader]   # pixels prêts pour drawImage (None pour un JPEG)
+    jpeg_data: Optional[bytes]      # JPEG intégré tel quel (DCTDecode)
+    size: Tuple[int, int]
+    use_jpeg: bool
+    flate_len: Optional[int]   # taille Flate des pixels traités, pour estimer le gain du JPEG
+
+class ImageCache:
+    """
+    Images traitées pour un PDF, indexées par (empreinte de la source, couleur de fond, mode 'pc_', taille cible) ;
+    une image sans transparence ne dépend pas de la couleur de la carte.
+    Chaque image traitée est émise une seule fois comme XObject, puis référencée par toutes les cartes.
+    Les images sont ramenées à `target_dpi` pour leur taille d'impression et, si `jpeg_quality` est
+    fourni, les images sans transparence sont ré-encodées en JPEG.
+    Avec `workers` > 1, le traitement PIL tourne dans un pool de threads : prefetch() le lance dès
+    qu'une feuille est mise en page, pendant que la précédente est dessinée.
+    Quels que soient `workers` et les caches, chaque XObject est intégré à sa première utilisation,
+    dans l'ordre des cartes, et une image en échec lève son exception à l'appelant : le PDF ne dépend
+    que des cartes, des images et des options.
+    Avec un `render_cache`, les images déjà traitées lors d'une génération précédente sont reprises.
+    Avec `soft_mask`, les images transparentes ne sont pas composées sur la couleur de la carte :
+    elles sont intégrées en RGB avec leur canal alpha comme masque PDF (SMask), dessinées par-dessus
+    le fond déjà tracé, et une seule image sert pour toutes les couleurs de carte.
+    Avec un `disk_cache`, une image déjà traitée lors d'une exécution précédente est relue du disque,
+    sans décoder la source ni travail PIL.
+    """
+    def __init__(
+        self,
+        c: canvas.Canvas,
+        report: "BuildReport",
+        target_dpi: Optional[int] = TARGET_DPI,
+        jpeg_quality: Optional[int] = None,
+        workers: int = 0,
+        render_cache: Optional["RenderCache"] = None,
+        soft_mask: bool = False,
+        disk_cache: Optional["DiskImageCache"] = None
+    ):
+        self.c = c
+        self.report = report
+        self.target_dpi = target_dpi
+        self.jpeg_quality = jpeg_quality
+        self.render_cache = render_cache
+        self.soft_mask = soft_mask
+        self.disk_cache = disk_cache
+        self._source_digests: Dict[int, str] = {}
+        self._opaque: Dict[str, bool] = {}
+        self._prepared: Dict[Tuple, PreparedImage] = {}
+        self._failed: Dict[str, Exception] = {}   # nom de formulaire -> erreur pendant son intégration
+        self._xobjects: Set[str] = set()          # noms des XObject image déjà dans le document
+        self._pending: Dict[Tuple, Future] = {}
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix="flashcard3-images") if workers > 1 else None
+
+    def source_digest(self, img: CardImage) -> str:
+        if isinstance(img, ZipImage):
+            return img.digest
+        # Sources are hashed once per document, however many cards use them
+        digest = self._source_digests.get(id(img))
+        if digest is None:
+            digest = image_digest(img)
+            self._source_digests[id(img)] = digest
+        return digest
+
+    def is_opaque(self, source: CardImage, img: Image.Image, digest: str) -> bool:
+        opaque = self._opaque.get(digest)
+        if opaque is None:
+            if isinstance(source, ZipImage) and not source.header.has_alpha:
+                opaque = True # from the manifest, no pixel scan
+            else:
+                opaque = img.mode not in ("RGBA", "LA", "PA") or img.getchannel("A").getextrema() == (255, 255)
+            self._opaque[digest] = opaque
+        return opaque
+
+    def target_size(self, src_size: Tuple[int, int], draw_w: float, draw_h: float) -> Optional[Tuple[int, int]]:
+        if not self.target_dpi:
+            return None
+        target_w = max(1, round(draw_w / inch * self.target_dpi))
+        target_h = max(1, round(draw_h / inch * self.target_dpi))
+        if target_w >= src_size[0] or target_h >= src_size[1]:
+            return None # Never upsample
+        return (target_w, target_h)
+
+    def process(self, job: ImageJob) -> ProcessedImage:
+        # Pure PIL work, no canvas access: safe to run in a worker thread
+        profile = self.report.profile
+        if self.disk_cache is not None:
+            with profile.stage("disk_cache_read"):
+                cached = self.disk_cache.get(self.cache_key(job))
+            if cached is not None:
+                profile.count("images_from_disk")
+                self.remember(job, cached)
+                return cached
+        profile.count("images_processed")
+        img = job.img
+        pixels = img
+        if isinstance(img, ZipImage):
+            draft_size = None
+            if job.target_size:
+                # Target size is in the processed orientation, 'pc_' images may be turned
+                draft_size = job.target_size
+                if job.full_card and img.size[0] > img.size[1]:
+                    draft_size = (job.target_size[1], job.target_size[0])
+            with profile.stage("zip_decode"):
+                pixels = img.open_image(draft_size)
+
+        with profile.stage("composite"):
+            processed = prepare_card_image(pixels, job.bg_color_tuple, job.full_card, job.target_size)
+            if job.bg_color_tuple is None:
+                # Soft mask: an alpha channel is embedded only when the image really has transparency
+                opaque = self.is_opaque(img, pixels, job.digest)
+                processed = processed.convert("RGB" if opaque else "RGBA")
+                use_jpeg = bool(self.jpeg_quality) and opaque
+            else:
+                use_jpeg = bool(self.jpeg_quality) and self.is_opaque(img, pixels, job.digest)
+        with profile.stage("encode"):
+            result = self.encode(processed, use_jpeg)
+        self.remember(job, result)
+        if self.disk_cache is not None:
+            with profile.stage("disk_cache_write"):
+                try:
+                    self.disk_cache.put(self.cache_key(job), result, processed)
+                except OSError as e: # full or read-only disk: the PDF does not depend on the cache
+                    profile.log("disk_cache_error", error=str(e))
+        return result
+
+    def remember(self, job: ImageJob, result: ProcessedImage):
+        if self.render_cache is not None:
+            nbytes = len(result.jpeg_data) if result.use_jpeg else result.size[0] * result.size[1] * 3
+            self.render_cache.put_image(self.cache_key(job), result, nbytes)
+
+    def cache_key(self, job: ImageJob) -> Tuple:
+        return (job.digest, job.bg_color_tuple, job.full_card, job.target_size, self.jpeg_quality)
+
+    def encode(self, processed: Image.Image, use_jpeg: bool) -> ProcessedImage:
+        if use_jpeg:
+            jpeg_buffer = io.BytesIO()
+            processed.save(jpeg_buffer, format="JPEG", quality=self.jpeg_quality, optimize=True)
+            flate_len = len(zlib.compress(processed.tobytes()))
+            return ProcessedImage(None, jpeg_buffer.getvalue(), processed.size, use_jpeg, flate_len)
+        reader = ImageReader(processed)
+        reader.getRGBData() # pixel bytes extracted here rather than in drawImage
+        return ProcessedImage(reader, None, processed.size, use_jpeg, None)
+
+    def embed(self, job: ImageJob, result: ProcessedImage):
+        failed = self._failed.get(job.prepared.name)
+        if failed is not None:
+            raise failed
+        # Unit-square form: placed anywhere with translate/scale
+        drawn = {"imgObj": None}
+        with self.report.profile.stage("draw_image"):
+            # A JPEG reader reads its file: one per document, the processed image may be shared
+            reader = ImageReader(io.BytesIO(result.jpeg_data)) if result.use_jpeg else result.reader
+            reader.getSize() # an unreadable payload fails here, before the form is opened
+            self.c.beginForm(job.prepared.name, 0, 0, 1, 1)
+            try:
+                self.c.drawImage(reader, 0, 0, width=1, height=1, mask="auto" if self.soft_mask else None,
+                                 extraReturn=drawn)
+            except Exception as e:
+                # The form name is now taken: the image is not retried on later cards
+                self._failed[job.prepared.name] = e
+                raise
+            finally:
+                # Otherwise the rest of the page would be drawn into the form
+                self.c.endForm()
+
+        # ReportLab stores identical pixels once, under a name derived from their content
+        image_object = drawn["imgObj"]
+        if image_object.name in self._xobjects:
+            return
+        self._xobjects.add(image_object.name)
+        embedded = len(image_object.streamContent)
+        smask = getattr(image_object, "smask", None)
+        if smask is not None: # alpha channel, a separate image object (see soft_mask)
+            embedded += len(self.c._doc.idToObject[smask.name].streamContent)
+        self.report.images_embedded += 1
+        self.report.image_bytes_embedded += embedded
+        if job.target_size or result.use_jpeg:
+            self.report.images_resampled += bool(job.target_size)
+            self.report.images_jpeg += result.use_jpeg
+            # Full resolution size estimated from the Flate size of the processed pixels
+            flate_len = result.flate_len if result.use_jpeg else embedded
+            src_w, src_h = job.src_size
+            full_res_estimate = flate_len * (src_w * src_h) / (result.size[0] * result.size[1])
+            self.report.image_bytes_saved += max(int(full_res_estimate) - embedded, 0)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+        self._pending.clear()
+
+    def job(
+        self,
+        img: CardImage,
+        bg_color_tuple: Tuple[int, int, int],
+        full_card: bool,
+        width: float,
+        height: float
+    ) -> Tuple[Tuple, ImageJob]:
+        # Same placement as drawImage(..., preserveAspectRatio=True): fit in the box
+        src_w, src_h = processed_image_size(img, full_card)
+        scale = min(width / src_w, height / src_h)
+        target_size = self.target_size((src_w, src_h), src_w * scale, src_h * scale)
+        if self.soft_mask or not has_alpha(img):
+            bg_color_tuple = None # same XObject whatever the card colour
+        digest = self.source_digest(img)
+        key = (digest, bg_color_tuple, full_card, target_size)
+        name = "img" + hashlib.sha1(repr(key).encode()).hexdigest()[:16]
+        prepared = PreparedImage(name, *(target_size or (src_w, src_h)))
+        return key, ImageJob(prepared, img, digest, bg_color_tuple, full_card, target_size, (src_w, src_h))
+
+    def prefetch(
+        self,
+        img: CardImage,
+        bg_color_tuple: Tuple[int, int, int],
+        full_card: bool,
+        width: float,
+        height: float
+    ):
+        """Lance en arrière-plan le traitement d'une image placée dans une boîte `width` x `height` (avec `workers` > 1)."""
+        if self._executor is None:
+            return
+        key, job = self.job(img, bg_color_tuple, full_card, width, height)
+        if key in self._prepared or key in self._pending:
+            return
+        if self.render_cache is not None and self.render_cache.get_image(self.cache_key(job)) is not None:
+            return
+        self._pending[key] = self._executor.submit(self.process, job)
+
+    def get(
+        self,
+        img: CardImage,
+        bg_color_tuple: Tuple[int, int, int],
+        full_card: bool,
+        width: float,
+        height: float
+    ) -> PreparedImage:
+        """XObject de l'image placée dans une boîte `width` x `height`, intégré à sa première utilisation."""
+        key, job = self.job(img, bg_color_tuple, full_card, width, height)
+        prepared = self._prepared.get(key)
+        if prepared is not None:
+            return prepared
+
+        future = self._pending.pop(key, None)
+        cached = self.render_cache.get_image(self.cache_key(job)) if self.render_cache is not None else None
+        if cached is not None:
+            # Processed during an earlier generation
+            self.report.images_reused += 1
+            result = cached
+        elif future is not None:
+            with self.report.profile.stage("image_wait"):
+                result = future.result()
+        else:
+            result = self.process(job)
+        # A failure propagates to the caller, which falls back to text; the next card retries
+        self.embed(job, result)
+        self._prepared[key] = job.prepared
+        return job.prepared
+
+    def draw(
+        self,
+        img: CardImage,
+        bg_color_tuple: Tuple[int, int, int],
+        x: float,
+        y: float,
+        width: float,
+        height: float,
+        full_card: bool = False
+    ):
+        """Dessine l'image ajustée et centrée dans la boîte, comme drawImage(..., preserveAspectRatio=True)."""
+        prepared = self.get(img, bg_color_tuple, full_card, width, height)
+        src_w, src_h = processed_image_size(img, full_card)
+        scale = min(width / src_w, height / src_h)
+        draw_w = src_w * scale
+        draw_h = src_h * scale
+        self.c.saveState()
+        self.c.translate(x + (width - draw_w) / 2, y + (height - draw_h) / 2)
+        self.c.scale(draw_w, draw_h)
+        self.c.doForm(prepared.name)
+        self.c.restoreState()
@@ -0,0 +1,103 @@
+"""Génération d'un PDF en arrière-plan, avec avancement et annulation (utilisée par l'application Streamlit)."""
+import threading, time
+from typing import Tuple, Optional, Callable, Hashable
+
+from .pdf import NB_CARTES, BuildCancelled, BuildReport, SpooledPdf
+
+# ----------------------------
+# Réglages
+# ----------------------------
+JOB_PENDING = "en attente"
+JOB_RUNNING = "en cours"
+JOB_DONE = "terminé"
+JOB_CANCELLED = "annulé"
+JOB_FAILED = "échec"
+
+# render(progress, cancel) passes both to build_pdf and returns the PDF with its report;
+# it closes the PDF itself when build_pdf raises
+RenderFunction = Callable[[Callable[[BuildReport], None], threading.Event], Tuple[SpooledPdf, BuildReport]]
+
+def expected_card_faces(n_cards: int, multi_page: bool) -> int:
+    """Faces de cartes que build_pdf dessinera (feuilles complétées par des cartes vides, recto et verso)."""
+    sheets = max(1, -(-n_cards // NB_CARTES)) if multi_page else 1
+    return sheets * NB_CARTES * 2
+
+class PdfJob:
+    """
+    Un PDF généré dans son propre thread (start) ou par un thread du RenderService : la page Streamlit
+    reste utilisable pendant la génération, lit l'avancement carte par carte et peut annuler.
+    `pdf` et `report` sont disponibles une fois la génération terminée ; après une annulation,
+    `report` décrit ce qui avait été dessiné (None si la génération n'avait pas commencé) ; pour un
+    lot, c'est un BatchReport (voir BatchCancelled).
+    """
+    def __init__(self, key: Hashable, render: RenderFunction, total_faces: int):
+        self.key = key
+        self.render = render
+        self.total_faces = max(1, total_faces)
+        self.state = JOB_PENDING
+        self.cards_drawn = 0
+        self.sheets = 0
+        self.pdf: Optional[SpooledPdf] = None
+        self.report: Optional[BuildReport] = None
+        self.error: Optional[BaseException] = None
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self._cancel = threading.Event()
+        self._thread = threading.Thread(target=self.run, name="flashcard3-pdf", daemon=True)
+
+    def start(self) -> "PdfJob":
+        self._thread.start()
+        return self
+
+    def run(self):
+        self.started = time.perf_counter()
+        if self._cancel.is_set(): # cancelled while waiting for a worker
+            self.state = JOB_CANCELLED
+            self.finished = self.started
+            return
+        self.state = JOB_RUNNING
+        try:
+            self.pdf, self.report = self.render(self.on_progress, self._cancel)
+            self.state = JOB_DONE
+        except BuildCancelled as e:
+            self.report = e.report
+            self.state = JOB_CANCELLED
+        except Exception as e:
+            self.error = e
+            self.state = JOB_FAILED
+        finally:
+            self.finished = time.perf_counter()
+
+    def on_progress(self, report: BuildReport):
+        # Called from the build thread, read by the page: plain attribute writes are enough
+        self.cards_drawn = report.cards_drawn
+        self.sheets = report.sheets
+
+    def cancel(self):
+        """Demande l'arrêt : pris en compte à la carte suivante, ou dès le départ si la génération n'a pas commencé."""
+        self._cancel.set()
+
+    @property
+    def cancelling(self) -> bool:
+        return self._cancel.is_set() and not self.done
+
+    @property
+    def done(self) -> bool:
+        return self.state in (JOB_DONE, JOB_CANCELLED, JOB_FAILED)
+
+    @property
+    def fraction(self) -> float:
+        if self.state == JOB_DONE:
+            return 1.0
+        return min(1.0, self.cards_drawn / self.total_faces)
+
+    @property
+    def elapsed(self) -> float:
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.perf_counter()) - self.started
+
+    def result(self) -> Tuple[SpooledPdf, BuildReport]:
+        if self.state != JOB_DONE:
+            raise RuntimeError(f"Génération {self.state}, pas de PDF disponible.")
+        return self.pdf, self.report
@@ -0,0 +1,772 @@
+"""Mise en page des cartes et génération du PDF recto/verso."""
+import io, copy, time, shutil, tempfile, threading, hashlib
+from functools import lru_cache
+from itertools import islice
+from typing import List, Dict, Tuple, Optional, Iterable, Iterator, NamedTuple, Mapping, Callable, BinaryIO
+
+from reportlab import rl_config
+from reportlab.pdfgen import canvas
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import cm, mm
+from reportlab.lib import colors
+from reportlab.platypus import Paragraph
+from reportlab.lib.styles import ParagraphStyle
+from reportlab.lib.enums import TA_CENTER
+
+from .cards import Card, parse_color_string, is_dark
+from .images import TARGET_DPI, IMAGE_WORKERS, CardImage, ImageCache, color_to_rgb_tuple, processed_image_size
+from .profiling import Profiler, stage
+from .disk_cache import DiskImageCache
+from .render_cache import RenderCache
+
+# ----------------------------
+# Réglages
+# ----------------------------
+# NB_CARTES, COLS, ROWS set to portrait layout (3x3 cards)
+NB_CARTES = 9
+COLS, ROWS = 3, 3
+
+MARGIN = 1.0 * cm
+GAP = 0.35 * cm              # espace entre cartes (découpe)
+BORDER_WIDTH = 1
+ELEMENT_SPACING = 0.8 * cm   # Espace entre les éléments (texte, image) et les bords de la carte
+RECTO_FRAME_WIDTH = 4 * mm   # Largeur du cadre pour l'option recto "cadre"
+
+# Styles du recto
+RECTO_STYLE_FILL = "Remplissage (couleur pleine)"
+RECTO_STYLE_FRAME = "Cadre 4 mm"
+RECTO_STYLES = (RECTO_STYLE_FILL, RECTO_STYLE_FRAME)
+
+# Sortie PDF : gardée en mémoire jusqu'à cette taille, puis dans un fichier temporaire
+PDF_SPOOL_MAX_MEMORY = 8 * 1024 * 1024
+
+# Plans de cartes gardés en mémoire (une entrée par configuration distincte de carte)
+CARD_PLANS_CACHE_SIZE = 4096
+
+# Ajustement du texte : taille minimale de police et nombre d'essais pour faire tenir un texte
+MIN_FONT_SIZE = 7
+TEXT_FIT_STEPS = 6
+TEXT_FITS_CACHE_SIZE = 4096
+
+# ----------------------------
+# Mise en page
+# ----------------------------
+class Grid:
+    def __init__(self, page_w, page_h, card_w, card_h, x0, y0):
+        self.page_w = page_w
+        self.page_h = page_h
+        self.card_w = card_w
+        self.card_h = card_h
+        self.x0 = x0
+        self.y0 = y0
+
+def compute_grid() -> Grid:
+    # COLS, ROWS, NB_CARTES are now global variables, updated by Streamlit UI
+    page_w, page_h = A4
+    usable_w = page_w - 2*MARGIN - (COLS-1)*GAP
+    usable_h = page_h - 2*MARGIN - (ROWS-1)*GAP
+    card_w = usable_w / COLS
+    card_h = usable_h / ROWS
+    return Grid(page_w, page_h, card_w, card_h, MARGIN, MARGIN)
+
+def card_xy(grid: Grid, col: int, row: int) -> Tuple[float,float]:
+    # row 0 en haut
+    x = grid.x0 + col*(grid.card_w + GAP)
+    y_top = grid.page_h - grid.y0 - row*(grid.card_h + GAP)
+    y = y_top - grid.card_h
+    return x, y
+
+def draw_card_border(c: canvas.Canvas, x: float, y: float, w: float, h: float, stroke_color=colors.lightgrey):
+    c.setLineWidth(BORDER_WIDTH)
+    c.setStrokeColor(stroke_color)
+    c.rect(x, y, w, h, stroke=1, fill=0)
+
+class TextStyle(NamedTuple):
+    name: str
+    font_name: str
+    font_size: float
+    leading: float
+    color: colors.Color
+
+@lru_cache(maxsize=None)
+def paragraph_style(style: TextStyle) -> ParagraphStyle:
+    return ParagraphStyle(
+        style.name, fontName=style.font_name, fontSize=style.font_size, leading=style.leading,
+        alignment=TA_CENTER, textColor=style.color
+    )
+
+def wrap_paragraph(text: str, style: TextStyle, font_size: float, w: float, h: float) -> Tuple[Paragraph, float, bool]:
+    # Leading keeps its ratio to the font size
+    sized = style._replace(font_size=font_size, leading=style.leading * font_size / style.font_size)
+    p = Paragraph(text, paragraph_style(sized))
+    # A very large height lets the paragraph compute its natural height
+    _, text_height = p.wrap(w, h * 100)
+    return p, text_height, text_height <= h and p.minWidth() <= w
+
+@lru_cache(maxsize=TEXT_FITS_CACHE_SIZE)
+def fit_paragraph(text: str, style: TextStyle, w: float, h: float) -> Tuple[Paragraph, float]:
+    """
+    Paragraphe mis en forme pour la boîte (w, h) et sa hauteur. Un texte trop grand est
+    réduit par dichotomie (au plus TEXT_FIT_STEPS essais, jusqu'à MIN_FONT_SIZE) au lieu de déborder ;
+    à MIN_FONT_SIZE, les lignes qui ne tiennent pas sont coupées.
+    """
+    p, text_height, fits = wrap_paragraph(text, style, style.font_size, w, h)
+    if not fits:
+        fitted = None
+        smallest, largest = MIN_FONT_SIZE, style.font_size
+        for _ in range(TEXT_FIT_STEPS):
+            font_size = round(smallest + largest) / 2 # half points
+            if font_size in (smallest, largest):
+                break
+            attempt = wrap_paragraph(text, style, font_size, w, h)
+            if attempt[2]:
+                fitted, smallest = attempt, font_size
+            else:
+                largest = font_size
+        p, text_height, _ = fitted or wrap_paragraph(text, style, MIN_FONT_SIZE, w, h)
+        if text_height > h:
+            # Still too long at the smallest size: the lines beyond the box are dropped rather than
+            # drawn over the card above
+            kept = p.split(w, h)
+            if kept:
+                p = kept[0]
+                _, text_height = p.wrap(w, h)
+
+    # Ensure text_height does not exceed h (not even one line fits)
+    return p, min(text_height, h)
+
+def fit_text_in_box(
+    x: float, y: float, w: float, h: float, text: str, style: TextStyle,
+    profile: Optional[Profiler] = None
+) -> Tuple[Paragraph, float, float]:
+    """Paragraphe centré dans la boîte et la position (x, y) où le dessiner."""
+    pad = 6 # Internal padding for the text within the card
+
+    # Calculate the inner dimensions for the text area
+    inner_x = x + pad
+    inner_y = y + pad
+    inner_w = w - 2 * pad
+    inner_h = h - 2 * pad
+
+    # Replace semicolons and newlines with line breaks for display
+    formatted_text = (text or "").replace(";", "<br/>").replace("\n","<br/>")
+    with stage(profile, "text_fit"):
+        p, text_height = fit_paragraph(formatted_text if formatted_text.strip() else "&nbsp;", style, inner_w, inner_h)
+
+    # Calculate vertical offset to center the text
+    y_offset = (inner_h - text_height) / 2
+
+    # The y-coordinate for drawOn is the bottom-left corner of the paragraph.
+    # We want to place the bottom of the paragraph at (inner_y + y_offset).
+    return p, inner_x, inner_y + y_offset
+
+def draw_paragraph(c: canvas.Canvas, p: Paragraph, x: float, y: float, profile: Optional[Profiler] = None):
+    # The wrapped paragraph is shared through the caches: draw a shallow copy
+    with stage(profile, "text_draw"):
+        copy.copy(p).drawOn(c, x, y)
+
+def draw_centered_text_in_box(
+    c: canvas.Canvas, x: float, y: float, w: float, h: float, text: str, style: TextStyle,
+    profile: Optional[Profiler] = None
+):
+    p, text_x, text_y = fit_text_in_box(x, y, w, h, text, style, profile)
+    draw_paragraph(c, p, text_x, text_y, profile)
+
+def draw_cut_marks(c: canvas.Canvas, grid: Grid):
+    c.setLineWidth(0.2) # Thinner lines for cut marks
+    c.setStrokeColor(colors.black)
+    page_w, page_h = A4
+
+    # Vertical grid lines: at left and right of each card block
+    for j in range(COLS):
+        x_left_card = grid.x0 + j * (grid.card_w + GAP)
+        x_right_card = x_left_card + grid.card_w
+        c.line(x_left_card, 0, x_left_card, page_h) # Left edge of card, extends full page
+        c.line(x_right_card, 0, x_right_card, page_h) # Right edge of card, extends full page
+
+    # Horizontal grid lines: at bottom and top of each card block
+    for i in range(ROWS):
+        y_bottom_card = grid.y0 + i * (grid.card_h + GAP)
+        y_top_card = y_bottom_card + grid.card_h
+        c.line(0, y_bottom_card, page_w, y_bottom_card) # Bottom edge of card, extends full page
+        c.line(0, y_top_card, page_w, y_top_card) # Top edge of card, extends full page
+
+class CardError(NamedTuple):
+    card: int      # index de la carte dans le paquet (à partir de 0)
+    side: str      # "recto" ou "verso"
+    message: str
+
+class BuildReport:
+    def __init__(self):
+        self.sheets = 0
+        self.images_embedded = 0
+        self.images_resampled = 0
+        self.images_jpeg = 0
+        self.image_bytes_embedded = 0
+        self.image_bytes_saved = 0   # estimation par rapport à une intégration pleine résolution
+        self.errors: List[CardError] = []
+        self.cards_drawn = 0         # faces de cartes dessinées (cartes vides comprises), pour l'avancement
+        self.sheets_reused = 0       # feuilles reprises du cache de rendu
+        self.images_reused = 0       # images traitées reprises du cache de rendu
+        self.profile = Profiler()   # temps par étape, compteurs et mémoire
+
+    def add_error(self, card: int, side: str, message: str):
+        self.errors.append(CardError(card, side, message))
+
+class BinaryStreams:
+    """
+    Pendant une génération, ReportLab écrit les flux du PDF en binaire : l'ASCII85 qu'il utilise par
+    défaut rend chaque image et chaque page 25 % plus grosse, sans utilité dans un PDF binaire.
+    Le réglage de ReportLab vaut pour tout le processus : il est changé tant qu'au moins une
+    génération est en cours, puis rétabli.
+    """
+    _lock = threading.Lock()
+    _active = 0
+    _saved = None
+
+    def __enter__(self):
+        with BinaryStreams._lock:
+            if BinaryStreams._active == 0:
+                BinaryStreams._saved = rl_config.useA85
+                rl_config.useA85 = 0
+            BinaryStreams._active += 1
+
+    def __exit__(self, *exc):
+        with BinaryStreams._lock:
+            BinaryStreams._active -= 1
+            if BinaryStreams._active == 0:
+                rl_config.useA85 = BinaryStreams._saved
+
+class BuildCancelled(Exception):
+    """Génération interrompue par `cancel` : le PDF est incomplet et ne doit pas être utilisé."""
+    def __init__(self, report: BuildReport):
+        super().__init__("Génération du PDF annulée.")
+        self.report = report
+
+EMPTY_CARD = {"question": "", "texte": ""}
+
+def iter_card_pages(cards: Iterable[Dict[str,str]], per_page: int) -> Iterator[List[Dict[str,str]]]:
+    """
+    Découpe un flux de cartes en pages de `per_page` cartes, sans matérialiser tout le paquet.
+    La dernière page est complétée par des cartes vides ; un paquet vide donne une page vide.
+    """
+    it = iter(cards)
+    first = True
+    while True:
+        chunk = list(islice(it, per_page))
+        if not chunk and not first:
+            return
+        first = False
+        yield chunk + [EMPTY_CARD] * (per_page - len(chunk))
+
+# ----------------------------
+# Plan de mise en page
+# ----------------------------
+# A card is laid out once per distinct configuration (side, text, image and its size, colour, style)
+# into immutable draw operations relative to its lower-left corner. Pages are lists of placed card
+# plans; the canvas backend below only executes them, and a preview can replay the same plans.
+SIDES = ("recto", "verso")
+
+class FillRect(NamedTuple):
+    x: float
+    y: float
+    w: float
+    h: float
+    color: colors.Color
+
+class StrokeRect(NamedTuple):
+    x: float
+    y: float
+    w: float
+    h: float
+    color: colors.Color
+    line_width: float
+
+class TextBox(NamedTuple):
+    x: float
+    y: float
+    w: float
+    h: float
+    text: str
+    style: TextStyle
+
+class FittedText(NamedTuple):
+    x: float                      # position du paragraphe (drawOn)
+    y: float
+    paragraph: Paragraph          # déjà mis en forme (voir fit_text_in_box)
+
+class ImagePlacement(NamedTuple):
+    name: str                     # nom du fichier image (clé de l'archive)
+    bg_color: Tuple[int, int, int]
+    x: float
+    y: float
+    w: float
+    h: float
+    full_card: bool               # image 'pc_' : pivotée et agrandie à toute la carte
+    error: str                    # message si l'image échoue, avec {card} et {error}
+    fallback: Tuple               # dessiné à la place du reste de la carte si l'image échoue
+
+class CardPlan(NamedTuple):
+    ops: Tuple
+    errors: Tuple[Tuple[str, str], ...] = ()   # (message avec {card} et {error}, détail)
+
+class PlacedCard(NamedTuple):
+    index: int
+    x: float
+    y: float
+    plan: CardPlan
+
+class PagePlan(NamedTuple):
+    side: str
+    cards: Tuple[PlacedCard, ...]
+    cut_marks: bool
+
+def card_text_style(side: str, back_color: colors.Color, frame_layout: bool) -> TextStyle:
+    if side == "verso":
+        return TextStyle("Verso", "Helvetica", 12.5, 14.5, colors.black)
+    # Recto text color adapted to the background
+    text_color = colors.black if frame_layout else (colors.white if is_dark(back_color) else colors.black)
+    return TextStyle("Recto", "Helvetica", 16, 18, text_color)
+
+@lru_cache(maxsize=CARD_PLANS_CACHE_SIZE)
+def layout_card(
+    side: str,
+    card_w: float,
+    card_h: float,
+    text: str,
+    image_name: Optional[str],
+    image_size: Optional[Tuple[int, int]],
+    image_error: str,
+    pc_mode: bool,
+    back_color: colors.Color,
+    frame_style: bool
+) -> CardPlan:
+    """
+    Mise en page d'une face de carte. `image_size` est la taille de l'image après traitement
+    (pivotée pour une image 'pc_') ; `image_error` l'erreur rencontrée en la lisant.
+    """
+    recto = side == "recto"
+    frame_layout = recto and (frame_style or pc_mode)
+    style = card_text_style(side, back_color, frame_layout)
+    ops = []
+
+    if recto:
+        fill_color = colors.white if frame_style else back_color
+        ops.append(FillRect(0, 0, card_w, card_h, fill_color))
+        if frame_style:
+            ops.append(StrokeRect(
+                RECTO_FRAME_WIDTH / 2, RECTO_FRAME_WIDTH / 2,
+                card_w - RECTO_FRAME_WIDTH, card_h - RECTO_FRAME_WIDTH,
+                back_color, RECTO_FRAME_WIDTH
+            ))
+        bg_color = color_to_rgb_tuple(fill_color)
+    else:
+        # Verso background stays white, also behind transparent images
+        bg_color = (255, 255, 255)
+
+    inset = RECTO_FRAME_WIDTH if frame_layout else 0
+    x, y = inset, inset
+    w, h = card_w - 2 * inset, card_h - 2 * inset
+
+    if image_name is None:
+        # No image, draw text in the full card area
+        ops.append(TextBox(x, y, w, h, text, style))
+        return CardPlan(tuple(ops))
+
+    image_label = "l'image" if recto else "l'image de verso"
+    if pc_mode:
+        # 'pc_' image, no text: rotated to portrait and scaled to the whole card
+        error = f"Erreur lors du traitement de l'image 'pc_' ({side}) pour la carte {{card}}: {{error}}"
+        fallback = ()
+    elif not text:
+        # No text, image takes up 90% of the card, centered
+        error = f"Erreur lors du dessin de {image_label} (90% largeur, sans texte) : {{error}}"
+        fallback = (TextBox(x, y, w, h, "", style),)
+    else:
+        # Text is present: square image at the bottom, text box above it
+        error = f"Erreur lors du dessin de {image_label} (avec texte) : {{error}}"
+        fallback = (TextBox(x, y, w, h, text, style),)
+        img_w = img_h = h / 2
+        img_y = y + ELEMENT_SPACING
+        ops.append(ImagePlacement(image_name, bg_color, x + (w - img_w) / 2, img_y, img_w, img_h, False, error, fallback))
+        ops.append(TextBox(x, img_y + img_h + ELEMENT_SPACING, w, h - (3 * ELEMENT_SPACING + img_h), text, style))
+        return CardPlan(tuple(ops))
+
+    try:
+        if image_error:
+            raise ValueError(image_error)
+        src_w, src_h = image_size
+        if src_w == 0 or src_h == 0:
+            raise ValueError("Image has zero width or height, cannot calculate aspect ratio.")
+        if pc_mode:
+            scale = min(w / min(src_w, src_h), h / max(src_w, src_h))
+            img_w, img_h = src_w * scale, src_h * scale
+        else:
+            img_w = 0.9 * w
+            img_h = (src_h / src_w) * img_w
+            if img_h > 0.9 * h:
+                # Scaling by width makes it too tall, scale by height instead
+                img_h = 0.9 * h
+                img_w = (src_w / src_h) * img_h
+    except Exception as e:
+        return CardPlan(tuple(ops) + fallback, ((error, str(e)),))
+
+    ops.append(ImagePlacement(
+        image_name, bg_color, x + (w - img_w) / 2, y + (h - img_h) / 2, img_w, img_h, pc_mode, error, fallback
+    ))
+    return CardPlan(tuple(ops))
+
+def plan_card(
+    grid: Grid,
+    side: str,
+    card: Dict[str,str],
+    default_back_color: colors.Color,
+    uploaded_recto_images: Optional[Mapping[str, CardImage]],
+    recto_color_style: str
+) -> CardPlan:
+    recto = side == "recto"
+    text = card.get("question" if recto else "texte", "").strip()
+    image_name = card.get("image_recto" if recto else "image_verso", "").strip()
+    pc_mode = bool(not text and image_name and image_name.lower().startswith("pc_"))
+
+    img = None
+    if image_name and uploaded_recto_images and image_name in uploaded_recto_images:
+        img = uploaded_recto_images[image_name]
+    image_size, image_error = None, ""
+    if img is not None:
+        try:
+            image_size = processed_image_size(img, full_card=pc_mode)
+        except Exception as e:
+            image_error = str(e)
+
+    if recto:
+        back_color = parse_color_string(card.get("card_color_key"), default_back_color)
+    else:
+        back_color = colors.white
+    return layout_card(
+        side, grid.card_w, grid.card_h, text,
+        image_name if img is not None else None, image_size, image_error, pc_mode,
+        back_color, recto and recto_color_style == RECTO_STYLE_FRAME
+    )
+
+def plan_page(
+    grid: Grid,
+    side: str,
+    page_cards: List[Dict[str,str]],
+    first_index: int,
+    default_back_color: colors.Color,
+    uploaded_recto_images: Optional[Mapping[str, CardImage]],
+    recto_color_style: str
+) -> PagePlan:
+    placed = []
+    for slot, card in enumerate(page_cards):
+        row = slot // COLS
+        col = slot % COLS
+        if side == "verso":
+            col = COLS - 1 - col # inversion colonnes pour impression recto/verso
+        x, y = card_xy(grid, col, row)
+        plan = plan_card(grid, side, card, default_back_color, uploaded_recto_images, recto_color_style)
+        placed.append(PlacedCard(first_index + slot, x, y, plan))
+    # No cut marks on the verso
+    return PagePlan(side, tuple(placed), cut_marks=side == "recto")
+
+def fit_op(op, profile: Optional[Profiler] = None):
+    if isinstance(op, TextBox):
+        p, text_x, text_y = fit_text_in_box(op.x, op.y, op.w, op.h, op.text, op.style, profile)
+        return FittedText(text_x, text_y, p)
+    if isinstance(op, ImagePlacement):
+        return op._replace(fallback=tuple(fit_op(fallback_op, profile) for fallback_op in op.fallback))
+    return op
+
+def fit_page(page: PagePlan, profile: Optional[Profiler] = None) -> PagePlan:
+    """La page avec ses zones de texte déjà mises en forme (FittedText), prête à être rejouée."""
+    return page._replace(cards=tuple(
+        placed._replace(plan=placed.plan._replace(ops=tuple(fit_op(op, profile) for op in placed.plan.ops)))
+        for placed in page.cards
+    ))
+
+def sheet_key(
+    page_cards: List[Dict[str,str]],
+    first_index: int,
+    default_back_color: colors.Color,
+    uploaded_recto_images: Optional[Mapping[str, CardImage]],
+    recto_color_style: str,
+    images: ImageCache
+) -> str:
+    """Empreinte d'une feuille : ses cartes, le contenu des images qu'elles utilisent et les options."""
+    h = hashlib.sha1(repr((first_index, default_back_color.hexval(), recto_color_style)).encode())
+    for card in page_cards:
+        h.update(repr(tuple(card.get(field) for field in Card._fields)).encode())
+        for field in ("image_recto", "image_verso"):
+            name = (card.get(field) or "").strip()
+            if name and uploaded_recto_images and name in uploaded_recto_images:
+                h.update(images.source_digest(uploaded_recto_images[name]).encode())
+            h.update(b"\0")
+    return h.hexdigest()
+
+# ----------------------------
+# Dessin (ReportLab)
+# ----------------------------
+def draw_op(c: canvas.Canvas, x: float, y: float, op, profile: Optional[Profiler] = None):
+    if isinstance(op, FillRect):
+        c.setFillColor(op.color)
+        c.rect(x + op.x, y + op.y, op.w, op.h, stroke=0, fill=1)
+    elif isinstance(op, StrokeRect):
+        c.setLineWidth(op.line_width)
+        c.setStrokeColor(op.color)
+        c.rect(x + op.x, y + op.y, op.w, op.h, stroke=1, fill=0)
+    elif isinstance(op, FittedText):
+        draw_paragraph(c, op.paragraph, x + op.x, y + op.y, profile)
+    elif isinstance(op, TextBox):
+        draw_centered_text_in_box(c, x + op.x, y + op.y, op.w, op.h, op.text, op.style, profile)
+
+class PageForms:
+    """
+    Éléments répétés des pages, définis une fois par document comme form XObjects (beginForm) et
+    référencés ensuite (doForm) : la grille de découpe et les fonds de carte (remplissage et cadre)
+    par couleur et style, y compris ceux des cartes vides.
+    """
+    def __init__(self, c: canvas.Canvas, grid: Grid):
+        self.c = c
+        self.grid = grid
+        self._names: Dict[Tuple, str] = {}
+
+    def cut_marks(self):
+        name = self._names.get(("cut_marks",))
+        if name is None:
+            name = self._names[("cut_marks",)] = "cutmarks"
+            page_w, page_h = A4
+            self.c.beginForm(name, 0, 0, page_w, page_h)
+            draw_cut_marks(self.c, self.grid)
+            self.c.endForm()
+        self.c.doForm(name)
+
+    def background(self, x: float, y: float, ops: Tuple):
+        # Forms are drawn at the origin: the card is placed with a translation
+        name = self._names.get(ops)
+        if name is None:
+            name = self._names[ops] = f"bg{len(self._names)}"
+            self.c.beginForm(name, 0, 0, self.grid.card_w, self.grid.card_h)
+            for op in ops:
+                draw_op(self.c, 0, 0, op)
+            self.c.endForm()
+        self.c.saveState()
+        self.c.translate(x, y)
+        self.c.doForm(name)
+        self.c.restoreState()
+
+def background_ops(ops: Tuple) -> int:
+    # Fill and frame come first in a card plan, before its text and image
+    n = 0
+    while n < len(ops) and isinstance(ops[n], (FillRect, StrokeRect)):
+        n += 1
+    return n
+
+def draw_page(
+    c: canvas.Canvas,
+    grid: Grid,
+    page: PagePlan,
+    uploaded_recto_images: Optional[Mapping[str, CardImage]],
+    images: ImageCache,
+    report: BuildReport,
+    checkpoint: Optional[Callable[[], None]] = None,
+    forms: Optional[PageForms] = None
+):
+    profile = report.profile
+    for placed in page.cards:
+        if checkpoint is not None:
+            checkpoint()
+        started = time.perf_counter()
+        draw_card(c, placed, page.side, uploaded_recto_images, images, report, forms)
+        profile.card(placed.index, page.side, time.perf_counter() - started)
+        report.cards_drawn += 1
+    if page.cut_marks:
+        if forms is not None:
+            forms.cut_marks()
+        else:
+            draw_cut_marks(c, grid)
+
+def prefetch_images(
+    pages: Iterable[PagePlan],
+    uploaded_recto_images: Optional[Mapping[str, CardImage]],
+    images: ImageCache
+):
+    """Lance le traitement des images d'une feuille avant qu'elle soit dessinée (voir ImageCache.prefetch)."""
+    for page in pages:
+        for placed in page.cards:
+            for op in placed.plan.ops:
+                if not isinstance(op, ImagePlacement):
+                    continue
+                try:
+                    images.prefetch(uploaded_recto_images[op.name], op.bg_color, op.full_card, op.w, op.h)
+                except Exception:
+                    pass # reported when the card is drawn
+
+def draw_card(
+    c: canvas.Canvas,
+    placed: PlacedCard,
+    side: str,
+    uploaded_recto_images: Optional[Mapping[str, CardImage]],
+    images: ImageCache,
+    report: BuildReport,
+    forms: Optional[PageForms] = None
+):
+    i, x, y = placed.index, placed.x, placed.y
+    for message, detail in placed.plan.errors:
+        report.add_error(i, side, message.format(card=i, error=detail))
+    ops = placed.plan.ops
+    if forms is not None:
+        n = background_ops(ops)
+        if n:
+            forms.background(x, y, ops[:n])
+            ops = ops[n:]
+    for op in ops:
+        if not isinstance(op, ImagePlacement):
+            draw_op(c, x, y, op, report.profile)
+            continue
+        try:
+            images.draw(
+                uploaded_recto_images[op.name], op.bg_color, x + op.x, y + op.y, op.w, op.h,
+                full_card=op.full_card
+            )
+        except Exception as e:
+            report.add_error(i, side, op.error.format(card=i, error=e))
+            for fallback_op in op.fallback:
+                draw_op(c, x, y, fallback_op, report.profile)
+            break
+
+class SpooledPdf:
+    """
+    PDF généré dans un fichier temporaire : en mémoire jusqu'à PDF_SPOOL_MAX_MEMORY, sur disque au-delà.
+    Peut être partagé entre sessions (lecture sous verrou) ; le fichier disparaît avec l'objet.
+    """
+    def __init__(self, max_memory: int = PDF_SPOOL_MAX_MEMORY):
+        self.file = tempfile.SpooledTemporaryFile(max_size=max_memory)
+        self._lock = threading.Lock()
+
+    @property
+    def size(self) -> int:
+        with self._lock:
+            return self.file.seek(0, io.SEEK_END)
+
+    def read(self) -> bytes:
+        with self._lock:
+            self.file.seek(0)
+            return self.file.read()
+
+    def copy_to(self, f: BinaryIO):
+        """Écrit le PDF dans `f` par morceaux, sans le charger entièrement en mémoire."""
+        with self._lock:
+            self.file.seek(0)
+            shutil.copyfileobj(self.file, f)
+
+    def close(self):
+        self.file.close()
+
+def build_pdf(
+    cards: Iterable[Dict[str,str]],
+    default_back_color: colors.Color,
+    output_buffer: io.BytesIO,
+    uploaded_recto_images: Mapping[str, CardImage] = None,
+    recto_color_style: str = RECTO_STYLE_FILL,
+    multi_page: bool = False,
+    target_dpi: Optional[int] = TARGET_DPI,
+    jpeg_quality: Optional[int] = None,
+    image_workers: int = IMAGE_WORKERS,
+    page_compression: bool = True,
+    render_cache: Optional[RenderCache] = None,
+    progress: Optional[Callable[[BuildReport], None]] = None,
+    cancel: Optional[threading.Event] = None,
+    image_soft_mask: bool = False,
+    disk_cache: Optional[DiskImageCache] = None,
+    reproducible: bool = False
+) -> BuildReport:
+    """
+    Dessine les cartes en paires de pages recto/verso dans `output_buffer` et renvoie un BuildReport
+    (une image illisible est signalée par carte, la carte garde son texte). Sans `multi_page`, seule
+    la première feuille est dessinée. Images réduites à `target_dpi`, ré-encodées en JPEG avec
+    `jpeg_quality`, transparence en masque PDF avec `image_soft_mask`. `render_cache` et `disk_cache`
+    reprennent feuilles et images d'une génération précédente ; `progress(report)` est appelé à chaque
+    carte et `cancel` lève BuildCancelled ; `reproducible` donne un PDF identique octet pour octet.
+    """
+    grid = compute_grid()
+
+    if not multi_page:
+        cards = islice(cards, NB_CARTES)
+
+    started = time.perf_counter()
+    with BinaryStreams():
+        # Image and form names are content hashes, so only the date and /ID vary between runs
+        c = canvas.Canvas(output_buffer, pagesize=A4, pageCompression=int(page_compression),
+                          invariant=int(reproducible))
+        report = BuildReport()
+        profile = report.profile
+        images = ImageCache(c, report, target_dpi=target_dpi, jpeg_quality=jpeg_quality, workers=image_workers,
+                            render_cache=render_cache, soft_mask=image_soft_mask, disk_cache=disk_cache)
+        forms = PageForms(c, grid)
+
+        def checkpoint():
+            # Called at card boundaries only, so that a cancelled build never stops halfway through a card
+            if cancel is not None and cancel.is_set():
+                raise BuildCancelled(report)
+            if progress is not None:
+                progress(report)
+
+        def plan_sheet(page_cards: List[Dict[str,str]], first_index: int) -> Tuple[PagePlan, ...]:
+            pages = None
+            if render_cache is not None:
+                key = sheet_key(page_cards, first_index, default_back_color, uploaded_recto_images,
+                                recto_color_style, images)
+                pages = render_cache.get_sheet(key)
+            if pages is None:
+                with profile.stage("layout"):
+                    pages = tuple(
+                        fit_page(plan_page(grid, side, page_cards, first_index, default_back_color,
+                                           uploaded_recto_images, recto_color_style), profile)
+                        for side in SIDES
+                    )
+                if render_cache is not None:
+                    render_cache.put_sheet(key, pages)
+            else:
+                report.sheets_reused += 1
+            with profile.stage("prefetch"):
+                prefetch_images(pages, uploaded_recto_images, images)
+            return pages
+
+        with profile.memory():
+            try:
+                sheets = iter_card_pages(cards, NB_CARTES)
+                checkpoint()
+                pages = plan_sheet(next(sheets), 0)
+                while pages is not None:
+                    # The next sheet is planned and its images submitted before this one is drawn
+                    next_pages = None
+                    page_cards = next(sheets, None)
+                    if page_cards is not None:
+                        checkpoint()
+                        next_pages = plan_sheet(page_cards, (report.sheets + 1) * NB_CARTES)
+
+                    for page in pages:
+                        with profile.stage("draw"):
+                            draw_page(c, grid, page, uploaded_recto_images, images, report, checkpoint, forms)
+                        c.showPage()
+                        checkpoint()
+                    report.sheets += 1
+                    pages = next_pages
+            except BuildCancelled:
+                profile.finish()
+                profile.log("build_pdf_cancelled", sheets=report.sheets, cards_drawn=report.cards_drawn)
+                raise
+            finally:
+                images.close()
+
+            with profile.stage("save"):
+                c.save()
+    profile.add("build_pdf", time.perf_counter() - started)
+    profile.count("sheets", report.sheets)
+    profile.count("image_bytes_embedded", report.image_bytes_embedded)
+    profile.count("sheets_reused", report.sheets_reused)
+    profile.count("images_reused", report.images_reused)
+    profile.finish()
+    profile.log("build_pdf", errors=len(report.errors))
+    return report
@@ -0,0 +1,156 @@
+"""Aperçu basse résolution des cartes, dessiné avec PIL à partir des mêmes plans que le PDF."""
+import hashlib, os, threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import List, Tuple, Optional, Mapping
+
+import reportlab
+from PIL import Image, ImageDraw, ImageFont
+from reportlab.lib import colors
+from reportlab.platypus import Paragraph
+
+from .cards import Card
+from .images import CardImage, ZipImage, color_to_rgb_tuple, prepare_card_image, processed_image_size
+from .pdf import (
+    FillRect, StrokeRect, TextBox, FittedText, ImagePlacement, CardPlan,
+    compute_grid, plan_card, fit_op
+)
+
+# ----------------------------
+# Réglages
+# ----------------------------
+PREVIEW_DPI = 50               # une carte fait environ 120 x 175 pixels
+CACHED_PREVIEWS_MAX = 512      # aperçus de cartes gardés en mémoire
+# Helvetica substitute shipped with ReportLab: same metrics as the PDF text, with accented glyphs
+PREVIEW_FONT_FILE = os.path.join(os.path.dirname(reportlab.__file__), "fonts", "_a______.pfb")
+
+@lru_cache(maxsize=64)
+def preview_font(size_px: int) -> ImageFont.ImageFont:
+    try:
+        return ImageFont.truetype(PREVIEW_FONT_FILE, size_px)
+    except OSError: # FreeType built without Type 1 support
+        return ImageFont.load_default()
+
+def paragraph_lines(p: Paragraph) -> List[str]:
+    # Lines as wrapped by ReportLab for the PDF, so that the preview breaks at the same words
+    para = p.blPara
+    if para.kind == 0:
+        return [" ".join(words) for _, words in para.lines]
+    return ["".join(getattr(frag, "text", "") for frag in line.words) for line in para.lines]
+
+class CardPreviewer:
+    """
+    Vignettes des cartes (une image PIL par face), mises en cache par contenu : texte, couleur, style,
+    empreinte des images et résolution. Seules les cartes affichées sont dessinées.
+    """
+    def __init__(self, dpi: int = PREVIEW_DPI, max_entries: int = CACHED_PREVIEWS_MAX):
+        self.dpi = dpi
+        self.scale = dpi / 72
+        self.grid = compute_grid()
+        self.max_entries = max_entries
+        self._previews: "OrderedDict[str, Image.Image]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def px(self, value: float) -> int:
+        return round(value * self.scale)
+
+    def key(
+        self,
+        card: Card,
+        side: str,
+        default_back_color: colors.Color,
+        uploaded_recto_images: Optional[Mapping[str, CardImage]],
+        recto_color_style: str
+    ) -> str:
+        h = hashlib.sha1(repr((side, self.dpi, default_back_color.hexval(), recto_color_style)).encode())
+        h.update(repr(tuple(card.get(field) for field in Card._fields)).encode())
+        name = (card.get("image_recto" if side == "recto" else "image_verso") or "").strip()
+        if name and uploaded_recto_images and name in uploaded_recto_images:
+            img = uploaded_recto_images[name]
+            # In-memory images have no content digest: identity is enough within a session
+            h.update(str(getattr(img, "digest", id(img))).encode())
+        return h.hexdigest()
+
+    def preview(
+        self,
+        card: Card,
+        side: str,
+        default_back_color: colors.Color,
+        uploaded_recto_images: Optional[Mapping[str, CardImage]] = None,
+        recto_color_style: str = ""
+    ) -> Image.Image:
+        key = self.key(card, side, default_back_color, uploaded_recto_images, recto_color_style)
+        with self._lock:
+            img = self._previews.get(key)
+            if img is not None:
+                self._previews.move_to_end(key)
+                return img
+
+        plan = plan_card(self.grid, side, card, default_back_color, uploaded_recto_images, recto_color_style)
+        img = self.render(plan, uploaded_recto_images)
+        with self._lock:
+            self._previews[key] = img
+            while len(self._previews) > self.max_entries:
+                self._previews.popitem(last=False)
+        return img
+
+    def render(self, plan: CardPlan, uploaded_recto_images: Optional[Mapping[str, CardImage]]) -> Image.Image:
+        width, height = self.px(self.grid.card_w), self.px(self.grid.card_h)
+        img = Image.new("RGB", (width, height), (255, 255, 255))
+        draw = ImageDraw.Draw(img)
+        for op in plan.ops:
+            if not isinstance(op, ImagePlacement):
+                self.draw_op(img, draw, op)
+                continue
+            try:
+                self.draw_image(img, op, uploaded_recto_images[op.name])
+            except Exception:
+                # Same fallback as the PDF, the error itself is reported by build_pdf
+                for fallback_op in op.fallback:
+                    self.draw_op(img, draw, fallback_op)
+                break
+        # Card outline, as cut on paper
+        draw.rectangle((0, 0, width - 1, height - 1), outline=(200, 200, 200))
+        return img
+
+    def box(self, img: Image.Image, x: float, y: float, w: float, h: float) -> Tuple[int, int, int, int]:
+        # PDF coordinates (origin at the bottom left, points) to pixels (origin at the top left)
+        return (self.px(x), img.height - self.px(y + h), self.px(x + w) - 1, img.height - self.px(y) - 1)
+
+    def draw_op(self, img: Image.Image, draw: ImageDraw.ImageDraw, op):
+        if isinstance(op, FillRect):
+            draw.rectangle(self.box(img, op.x, op.y, op.w, op.h), fill=color_to_rgb_tuple(op.color))
+        elif isinstance(op, StrokeRect):
+            # PDF strokes are centered on the path, PIL draws the outline inside the box
+            half = op.line_width / 2
+            draw.rectangle(
+                self.box(img, op.x - half, op.y - half, op.w + op.line_width, op.h + op.line_width),
+                outline=color_to_rgb_tuple(op.color), width=max(1, self.px(op.line_width))
+            )
+        elif isinstance(op, TextBox):
+            self.draw_op(img, draw, fit_op(op))
+        elif isinstance(op, FittedText):
+            self.draw_text(img, draw, op)
+
+    def draw_text(self, img: Image.Image, draw: ImageDraw.ImageDraw, op: FittedText):
+        p = op.paragraph
+        style = p.style
+        font = preview_font(max(1, self.px(style.fontSize)))
+        fill = color_to_rgb_tuple(style.textColor)
+        center_x = self.px(op.x + p.width / 2)
+        baseline = op.y + p.height - style.fontSize
+        for line in paragraph_lines(p):
+            draw.text((center_x, img.height - self.px(baseline)), line, font=font, fill=fill, anchor="ms")
+            baseline -= style.leading
+
+    def draw_image(self, img: Image.Image, op: ImagePlacement, source: CardImage):
+        # Fit and center in the box, as ImageCache.draw does in the PDF
+        src_w, src_h = processed_image_size(source, op.full_card)
+        scale = min(op.w / src_w, op.h / src_h)
+        draw_w, draw_h = src_w * scale, src_h * scale
+        x = op.x + (op.w - draw_w) / 2
+        y = op.y + (op.h - draw_h) / 2
+        target_size = (max(1, self.px(draw_w)), max(1, self.px(draw_h)))
+        pixels = source.open_image(target_size) if isinstance(source, ZipImage) else source
+        thumbnail = prepare_card_image(pixels, op.bg_color, op.full_card, target_size)
+        img.paste(thumbnail, (self.px(x), img.height - self.px(y) - target_size[1]))
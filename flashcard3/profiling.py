@@ -0,0 +1,144 @@
+"""Mesures par étape d'une génération (temps, compteurs, mémoire), sans profileur externe."""
+import os, heapq, json, logging, threading, time
+from contextlib import contextmanager, nullcontext
+from typing import List, Dict, Tuple, Optional
+
+logger = logging.getLogger("flashcard3")
+
+# ----------------------------
+# Réglages
+# ----------------------------
+SLOWEST_CARDS = 10          # cartes les plus lentes gardées dans le rapport
+RSS_SAMPLE_SECONDS = 0.05   # période de relevé de la mémoire résidente pendant une génération
+
+def current_rss_mb() -> Optional[float]:
+    """Mémoire résidente actuelle du processus (Mo), None hors Linux."""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return round(pages * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024, 1)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+class RssPeak:
+    """Pic de mémoire résidente (Mo) pendant un bloc `with`, relevé par un thread ; None hors Linux."""
+    def __init__(self, sample_seconds: float = RSS_SAMPLE_SECONDS):
+        self.sample_seconds = sample_seconds
+        self.start_mb = current_rss_mb()
+        self.peak_mb = self.start_mb
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self.sample, name="rss-peak", daemon=True)
+
+    def sample(self):
+        while not self._stop.wait(self.sample_seconds):
+            self.sample_once()
+
+    def __enter__(self) -> "RssPeak":
+        if self.start_mb is not None:
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self.start_mb is not None:
+            self._stop.set()
+            self._thread.join()
+            self.sample_once()
+
+    def sample_once(self):
+        rss = current_rss_mb()
+        if rss is not None and rss > self.peak_mb:
+            self.peak_mb = rss
+
+class Profiler:
+    """
+    Temps cumulés par étape, compteurs et cartes les plus lentes d'une génération.
+    Les étapes des images sont mesurées dans les threads de traitement : leur somme peut
+    dépasser la durée totale. La mémoire est le pic de mémoire résidente du processus relevé pendant
+    `memory()` (générations simultanées comprises), pas depuis le démarrage du serveur.
+    """
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+        self.calls: Dict[str, int] = {}
+        self.counters: Dict[str, int] = {}
+        self.slowest_cards: List[Tuple[float, int, str]] = []   # tas (durée, carte, face)
+        self.cards_timed = 0
+        self.peak_rss_mb: Optional[float] = None
+        self._lock = threading.Lock()
+        self._rss: Optional[RssPeak] = None
+
+    def __getstate__(self):
+        # Kept in BuildReport, which Streamlit pickles into its cache
+        state = self.__dict__.copy()
+        del state["_lock"], state["_rss"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        self._rss = None
+
+    def add(self, stage: str, seconds: float):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+            self.calls[stage] = self.calls.get(stage, 0) + 1
+
+    @contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+
+    def count(self, name: str, n: int = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def card(self, card: int, side: str, seconds: float):
+        self.cards_timed += 1
+        entry = (seconds, card, side)
+        if len(self.slowest_cards) < SLOWEST_CARDS:
+            heapq.heappush(self.slowest_cards, entry)
+        elif entry > self.slowest_cards[0]:
+            heapq.heapreplace(self.slowest_cards, entry)
+
+    @contextmanager
+    def memory(self):
+        """Relève le pic de mémoire résidente pendant le bloc (voir RssPeak)."""
+        with RssPeak() as rss:
+            self._rss = rss
+            try:
+                yield
+            finally:
+                self._rss = None
+        self.peak_rss_mb = rss.peak_mb
+
+    def finish(self):
+        # Within memory(), e.g. a cancelled build: the peak so far
+        if self._rss is not None:
+            self._rss.sample_once()
+            self.peak_rss_mb = self._rss.peak_mb
+
+    def as_dict(self) -> Dict:
+        return {
+            "stages": {
+                name: {"seconds": round(seconds, 4), "calls": self.calls[name]}
+                for name, seconds in sorted(self.stages.items(), key=lambda item: -item[1])
+            },
+            "counters": dict(self.counters),
+            "cards_timed": self.cards_timed,
+            "slowest_cards": [
+                {"card": card, "side": side, "seconds": round(seconds, 4)}
+                for seconds, card, side in sorted(self.slowest_cards, reverse=True)
+            ],
+            "peak_rss_mb": self.peak_rss_mb,
+        }
+
+    def log(self, event: str, **context):
+        """Une ligne JSON sur le logger `flashcard3` (niveau INFO)."""
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(json.dumps({"event": event, **context, **self.as_dict()}, ensure_ascii=False))
+
+def stage(profile: Optional[Profiler], name: str):
+    # For code paths where profiling is optional
+    return profile.stage(name) if profile is not None else nullcontext()
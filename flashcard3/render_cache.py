@@ -0,0 +1,70 @@
+"""Cache de rendu entre deux générations : feuilles déjà mises en page et images déjà traitées."""
+import threading
+from collections import OrderedDict
+from typing import Tuple, Optional, Hashable, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .images import ProcessedImage
+    from .pdf import PagePlan
+
+# ----------------------------
+# Réglages
+# ----------------------------
+RENDER_CACHE_SHEETS = 512                        # environ 150 Ko par feuille de texte (paragraphes mis en forme)
+RENDER_CACHE_IMAGE_BYTES = 256 * 1024 * 1024     # pixels des images traitées
+
+class RenderCache:
+    """
+    Feuilles (pages recto/verso prêtes à dessiner) indexées par l'empreinte de leurs cartes, de leurs
+    images et des options, et images traitées indexées par (source, fond, mode 'pc_', taille, JPEG).
+    Après une modification du CSV, seules les feuilles touchées sont remises en page et seules les
+    nouvelles images sont traitées. Partageable entre sessions : les clés sont des empreintes de contenu.
+    """
+    def __init__(self, max_sheets: int = RENDER_CACHE_SHEETS, max_image_bytes: int = RENDER_CACHE_IMAGE_BYTES):
+        self.max_sheets = max_sheets
+        self.max_image_bytes = max_image_bytes
+        self._sheets: "OrderedDict[str, Tuple[PagePlan, ...]]" = OrderedDict()
+        self._images: "OrderedDict[Hashable, Tuple[ProcessedImage, int]]" = OrderedDict()
+        self._image_bytes = 0
+        self._lock = threading.Lock()
+
+    def get_sheet(self, key: str) -> Optional[Tuple["PagePlan", ...]]:
+        with self._lock:
+            pages = self._sheets.get(key)
+            if pages is not None:
+                self._sheets.move_to_end(key)
+            return pages
+
+    def put_sheet(self, key: str, pages: Tuple["PagePlan", ...]):
+        with self._lock:
+            self._sheets[key] = pages
+            self._sheets.move_to_end(key)
+            while len(self._sheets) > self.max_sheets:
+                self._sheets.popitem(last=False)
+
+    def get_image(self, key: Hashable) -> Optional["ProcessedImage"]:
+        with self._lock:
+            entry = self._images.get(key)
+            if entry is None:
+                return None
+            self._images.move_to_end(key)
+            return entry[0]
+
+    def put_image(self, key: Hashable, processed: "ProcessedImage", nbytes: int):
+        if nbytes > self.max_image_bytes:
+            return
+        with self._lock:
+            previous = self._images.pop(key, None)
+            if previous is not None:
+                self._image_bytes -= previous[1]
+            self._images[key] = (processed, nbytes)
+            self._image_bytes += nbytes
+            while self._image_bytes > self.max_image_bytes:
+                _, (_, evicted_bytes) = self._images.popitem(last=False)
+                self._image_bytes -= evicted_bytes
+
+    def clear(self):
+        with self._lock:
+            self._sheets.clear()
+            self._images.clear()
+            self._image_bytes = 0
@@ -0,0 +1,239 @@
+"""
+Service de génération partagé par toutes les sessions de l'application : un nombre fixe de
+threads, une file d'attente servie à tour de rôle par session et un budget mémoire global.
+"""
+import heapq, threading
+from collections import OrderedDict, deque
+from typing import List, Dict, Deque, Optional, Sequence, Mapping, NamedTuple
+
+from .images import IMAGE_WORKERS, DECODED_IMAGES_CACHE_SIZE, CardImage, ZipImage
+from .jobs import PdfJob
+from .pdf import NB_CARTES, compute_grid
+
+# ----------------------------
+# Réglages
+# ----------------------------
+RENDER_WORKERS = 2                              # générations simultanées
+RENDER_QUEUE_MAX = 16                           # générations en attente, toutes sessions confondues
+RENDER_JOBS_PER_SESSION = 1                     # générations en attente ou en cours par session
+RENDER_MAX_SKIPS = 2                            # générations admises avant une génération qui attend de la mémoire
+RENDER_MEMORY_BUDGET = 1024 * 1024 * 1024       # mémoire de travail des générations en cours
+JOB_BASE_MEMORY = 48 * 1024 * 1024              # mise en page, polices et tampons du PDF, hors images
+DECODED_BYTES_PER_PIXEL = 4 * 2                 # RGBA décodé plus la copie composée sur le fond
+CARD_MEMORY = 2 * 1024                          # carte lue, son plan et son texte mis en forme
+PAGE_MEMORY = 8 * 1024                          # contenu d'une page, gardé par ReportLab jusqu'à la fin du PDF
+
+class RenderServiceBusy(Exception):
+    """Génération refusée : file pleine, session déjà servie ou paquet trop lourd pour le budget mémoire."""
+
+def decoded_pixels(img: CardImage, target_dpi: Optional[int]) -> int:
+    w, h = img.size
+    if target_dpi and isinstance(img, ZipImage) and img.header.format == "JPEG":
+        # Image.draft decodes JPEGs at 1/2, 1/4 or 1/8 while staying above the size drawn on the card
+        grid = compute_grid()
+        max_w, max_h = grid.card_w / 72 * target_dpi, grid.card_h / 72 * target_dpi
+        scale = 1
+        while scale < 8 and w / (scale * 2) >= max_w and h / (scale * 2) >= max_h:
+            scale *= 2
+        return (w // scale) * (h // scale)
+    return w * h
+
+def estimate_job_memory(
+    cards: Sequence[Mapping[str, str]],
+    images: Optional[Mapping[str, CardImage]],
+    multi_page: bool,
+    target_dpi: Optional[int],
+    image_workers: int = IMAGE_WORKERS
+) -> int:
+    """
+    Mémoire de travail estimée d'une génération (octets), d'après les dimensions des images utilisées
+    (manifeste de l'archive, sans décodage) : au plus DECODED_IMAGES_CACHE_SIZE + image_workers images
+    décodées à la fois, les plus grandes comptées, plus les cartes, les pages et un socle fixe.
+    """
+    if not multi_page:
+        cards = cards[:NB_CARTES]
+    pages = 2 * max(1, -(-len(cards) // NB_CARTES))
+    names = set()
+    for card in cards:
+        for key in ("image_recto", "image_verso"):
+            name = (card.get(key) or "").strip()
+            if name:
+                names.add(name)
+    pixels: List[int] = []
+    for name in names:
+        img = images.get(name) if images else None
+        if img is None:
+            continue
+        try:
+            pixels.append(decoded_pixels(img, target_dpi))
+        except Exception: # unreadable image, reported by build_pdf
+            continue
+    largest = heapq.nlargest(DECODED_IMAGES_CACHE_SIZE + image_workers, pixels)
+    return (JOB_BASE_MEMORY + len(cards) * CARD_MEMORY + pages * PAGE_MEMORY
+            + sum(largest) * DECODED_BYTES_PER_PIXEL)
+
+class QueuedJob(NamedTuple):
+    job: PdfJob
+    session: str
+    memory: int      # estimation, octets
+
+class RenderService:
+    """
+    File d'attente partagée des générations de PDF. Les sessions sont servies à tour de rôle, celles
+    qui ont le moins de générations en cours d'abord. Une génération ne démarre que si son estimation
+    mémoire tient dans ce qui reste du budget (sinon elle attend) ; une fois que `max_skips`
+    générations ont démarré avant elle, plus rien ne démarre avant qu'elle ait la mémoire nécessaire.
+    Une génération plus lourde que le budget entier ou au-delà des limites de la file est refusée par
+    RenderServiceBusy plutôt que de surcharger le serveur.
+    """
+    def __init__(
+        self,
+        workers: int = RENDER_WORKERS,
+        memory_budget: int = RENDER_MEMORY_BUDGET,
+        max_queued: int = RENDER_QUEUE_MAX,
+        jobs_per_session: int = RENDER_JOBS_PER_SESSION,
+        max_skips: int = RENDER_MAX_SKIPS
+    ):
+        self.memory_budget = memory_budget
+        self.max_queued = max_queued
+        self.jobs_per_session = jobs_per_session
+        self.max_skips = max_skips
+        # Session order is the round-robin order: a session moves to the end once one of its jobs starts
+        self._queues: "OrderedDict[str, Deque[QueuedJob]]" = OrderedDict()
+        self._running: Dict[int, QueuedJob] = {}
+        self._skips: Dict[int, int] = {}   # id(job) -> générations démarrées avant elle faute de mémoire
+        self._memory_in_use = 0
+        self._cond = threading.Condition()
+        self._threads = [
+            threading.Thread(target=self.worker, name=f"flashcard3-render-{i}", daemon=True)
+            for i in range(max(1, workers))
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, job: PdfJob, session: str, memory: int) -> int:
+        """Met la génération en file et renvoie sa position (1 = prochaine à démarrer)."""
+        with self._cond:
+            if memory > self.memory_budget:
+                raise RenderServiceBusy(
+                    f"Paquet trop lourd pour le serveur : environ {memory / 1e6:.0f} Mo estimés pour "
+                    f"{self.memory_budget / 1e6:.0f} Mo disponibles. Réduisez la résolution des images "
+                    "ou découpez le paquet."
+                )
+            queued = sum(len(queue) for queue in self._queues.values())
+            if queued >= self.max_queued:
+                raise RenderServiceBusy(
+                    f"Le serveur est saturé ({queued} générations en attente). Réessayez dans quelques minutes."
+                )
+            in_session = len(self._queues.get(session, ())) + sum(
+                1 for entry in self._running.values() if entry.session == session
+            )
+            if in_session >= self.jobs_per_session:
+                raise RenderServiceBusy("Une génération est déjà en cours pour cette session.")
+
+            self._queues.setdefault(session, deque()).append(QueuedJob(job, session, memory))
+            self._cond.notify()
+            return self._position(job)
+
+    def cancel(self, job: PdfJob):
+        """Annule une génération : retirée de la file si elle attend, arrêtée à la carte suivante sinon."""
+        job.cancel()
+        with self._cond:
+            removed = self._remove_pending(job)
+        if removed:
+            job.run() # returns at once, the cancel event is checked before building
+
+    def position(self, job: PdfJob) -> Optional[int]:
+        """Position dans la file (1 = prochaine), None si la génération a démarré ou n'est pas en file."""
+        with self._cond:
+            return self._position(job)
+
+    @property
+    def running(self) -> int:
+        with self._cond:
+            return len(self._running)
+
+    @property
+    def memory_in_use(self) -> int:
+        with self._cond:
+            return self._memory_in_use
+
+    def worker(self):
+        while True:
+            with self._cond:
+                entry = self._next()
+                while entry is None:
+                    self._cond.wait()
+                    entry = self._next()
+                self._running[id(entry.job)] = entry
+                self._memory_in_use += entry.memory
+            try:
+                entry.job.run()
+            finally:
+                with self._cond:
+                    del self._running[id(entry.job)]
+                    self._memory_in_use -= entry.memory
+                    self._cond.notify_all()
+
+    def _sessions(self) -> List[str]:
+        # Sessions with fewer running jobs first, then in round-robin order
+        running: Dict[str, int] = {}
+        for entry in self._running.values():
+            running[entry.session] = running.get(entry.session, 0) + 1
+        return sorted(self._queues, key=lambda session: running.get(session, 0))
+
+    def _starved(self, entry: QueuedJob) -> bool:
+        return self._skips.get(id(entry.job), 0) >= self.max_skips
+
+    def _next(self) -> Optional[QueuedJob]:
+        # First session in scheduling order whose next job fits in the memory left; a job passed over
+        # max_skips times reserves the memory: nothing else starts until it fits
+        heads = [self._queues[session][0] for session in self._sessions()]
+        starved = [entry for entry in heads if self._starved(entry)]
+        passed = []
+        for entry in starved or heads:
+            if self._memory_in_use + entry.memory > self.memory_budget:
+                passed.append(entry)
+                continue
+            queue = self._queues[entry.session]
+            queue.popleft()
+            if queue:
+                self._queues.move_to_end(entry.session)
+            else:
+                del self._queues[entry.session]
+            self._skips.pop(id(entry.job), None)
+            for skipped in passed:
+                self._skips[id(skipped.job)] = self._skips.get(id(skipped.job), 0) + 1
+            return entry
+        return None
+
+    def _order(self) -> List[QueuedJob]:
+        # Jobs in the order they would start with enough memory: one per session per round,
+        # a job holding the reserved memory first
+        sessions = sorted(self._sessions(), key=lambda session: not self._starved(self._queues[session][0]))
+        queues = [self._queues[session] for session in sessions]
+        order = []
+        depth = 0
+        while True:
+            round_jobs = [queue[depth] for queue in queues if len(queue) > depth]
+            if not round_jobs:
+                return order
+            order.extend(round_jobs)
+            depth += 1
+
+    def _position(self, job: PdfJob) -> Optional[int]:
+        for i, entry in enumerate(self._order()):
+            if entry.job is job:
+                return i + 1
+        return None
+
+    def _remove_pending(self, job: PdfJob) -> bool:
+        for session, queue in self._queues.items():
+            for entry in queue:
+                if entry.job is job:
+                    queue.remove(entry)
+                    self._skips.pop(id(job), None)
+                    if not queue:
+                        del self._queues[session]
+                    return True
+        return False
@@ -0,0 +1,105 @@
+"""Cache disque des PDF générés : un paquet inchangé (cartes, images, options) est repris tel quel."""
+import io, os, time, shutil, hashlib, inspect
+from typing import BinaryIO, Dict, Hashable, Mapping, Optional, Sequence
+
+from reportlab.lib import colors
+
+from .cards import Card
+from .disk_cache import CACHE_ROOT, DiskCache, code_digest
+from .images import CardImage, image_digest
+from .pdf import NB_CARTES, BuildReport, CardError, build_pdf
+
+# ----------------------------
+# Réglages
+# ----------------------------
+PDF_CACHE_DIR = os.path.join(CACHE_ROOT, "pdfs")
+PDF_CACHE_BYTES = 1024 * 1024 * 1024
+PDF_CACHE_FORMAT = b"FC3PDF1\n"
+# build_pdf options that change the PDF; workers, caches and callbacks only change how fast it is built
+OUTPUT_OPTIONS = ("recto_color_style", "multi_page", "target_dpi", "jpeg_quality", "page_compression", "image_soft_mask")
+REPORT_FIELDS = (
+    "sheets", "images_embedded", "images_resampled", "images_jpeg", "image_bytes_embedded",
+    "image_bytes_saved", "cards_drawn", "sheets_reused", "images_reused",
+)
+
+def deck_key(
+    cards: Sequence[Mapping[str, str]],
+    default_back_color: colors.Color,
+    uploaded_recto_images: Optional[Mapping[str, CardImage]] = None,
+    **options
+) -> str:
+    """
+    Empreinte d'un paquet pour PdfResultCache : les cartes utilisées, le contenu des images qu'elles
+    référencent et les options de build_pdf qui changent le PDF (valeurs par défaut comprises).
+    """
+    defaults = inspect.signature(build_pdf).parameters
+    values = tuple((name, options.get(name, defaults[name].default)) for name in OUTPUT_OPTIONS)
+    if not options.get("multi_page", defaults["multi_page"].default):
+        cards = cards[:NB_CARTES]
+    h = hashlib.sha1(repr((default_back_color.hexval(), values)).encode())
+    digests: Dict[str, str] = {}
+    for card in cards:
+        h.update(repr(tuple(card.get(field) for field in Card._fields)).encode())
+        for field in ("image_recto", "image_verso"):
+            name = (card.get(field) or "").strip()
+            if name and uploaded_recto_images and name in uploaded_recto_images:
+                if name not in digests:
+                    img = uploaded_recto_images[name]
+                    # A rejected image is drawn as a fallback, whatever its content
+                    digests[name] = getattr(img, "rejected", "") or image_digest(img)
+                h.update(digests[name].encode())
+            h.update(b"\0")
+    return h.hexdigest()
+
+def report_from_dict(data: Dict) -> BuildReport:
+    report = BuildReport()
+    for field in REPORT_FIELDS:
+        setattr(report, field, data[field])
+    report.errors = [CardError(*error) for error in data["errors"]]
+    return report
+
+def report_as_dict(report: BuildReport) -> Dict:
+    data = {field: getattr(report, field) for field in REPORT_FIELDS}
+    data["errors"] = [list(error) for error in report.errors]
+    return data
+
+class PdfResultCache(DiskCache):
+    """
+    PDF complets indexés par une clé d'entrée (deck_key, ou toute empreinte du CSV, des images et des
+    options) et par la version du code, avec le BuildReport de leur génération. Les PDF mis en cache
+    doivent avoir été générés avec `reproducible` : une entrée reprise est alors identique, octet pour
+    octet, à ce que la génération aurait produit.
+    """
+    format = PDF_CACHE_FORMAT
+    suffix = ".pdf"
+
+    def __init__(self, directory: str = PDF_CACHE_DIR, max_bytes: int = PDF_CACHE_BYTES):
+        super().__init__(directory, max_bytes)
+
+    def get(self, key: Hashable, output_buffer: BinaryIO) -> Optional[BuildReport]:
+        """Copie le PDF en cache dans `output_buffer` et renvoie son rapport, None si absent."""
+        started = time.perf_counter()
+        entry = self.open_entry((code_digest(), key))
+        if entry is None:
+            return None
+        header, f = entry
+        with f:
+            # Checked before copying anything, so that a truncated entry leaves the output untouched
+            if os.fstat(f.fileno()).st_size - f.tell() != header["size"]:
+                return None
+            shutil.copyfileobj(f, output_buffer)
+        report = report_from_dict(header["report"])
+        report.profile.add("pdf_from_cache", time.perf_counter() - started)
+        report.profile.count("pdf_from_cache")
+        report.profile.finish()
+        report.profile.log("build_pdf_cached", errors=len(report.errors))
+        return report
+
+    def put(self, key: Hashable, pdf: BinaryIO, report: BuildReport):
+        """`pdf` : fichier relisible contenant le PDF entier depuis le début."""
+        size = pdf.seek(0, io.SEEK_END)
+        pdf.seek(0)
+        try:
+            self.write_entry((code_digest(), key), {"size": size, "report": report_as_dict(report)}, pdf)
+        finally:
+            pdf.seek(0, io.SEEK_END)
@@ -0,0 +1,104 @@
+"""Lots : archive de PDF écrite au fil de l'eau, erreurs numérotées par paquet, annulation."""
+import io, zipfile, threading
+
+import pytest
+
+from flashcard3 import (
+    DEFAULT_BACK_COLOR, NB_CARTES, BatchCancelled, BatchDeck, BuildReport, build_batch_combined,
+    build_batch_zip, iter_cards_from_csv,
+)
+from flashcard3.batch import batch_window, read_decks_zip
+from flashcard3.images import ZipImageStore
+from flashcard3.pdf import SpooledPdf
+
+from test_reproducible import make_zip
+
+def deck(name: str, csv: str) -> BatchDeck:
+    return BatchDeck(name, name, list(iter_cards_from_csv(csv)), "")
+
+DECKS = [deck(f"paquets/{i}.csv", f"question;texte\n" + "".join(f"Q{i}.{n};R{n}\n" for n in range(i + 1)))
+         for i in range(7)]
+
+def test_zip_keeps_deck_order_and_few_pdfs_open():
+    opened, open_pdfs, peak = [], set(), [0]
+    lock = threading.Lock()
+
+    class TrackedPdf(SpooledPdf):
+        def close(self):
+            with lock:
+                open_pdfs.discard(id(self))
+            super().close()
+
+    def render_deck(d, progress, cancel):
+        pdf = TrackedPdf()
+        pdf.file.write(d.name.encode())
+        with lock:
+            opened.append(d.name)
+            open_pdfs.add(id(pdf))
+            peak[0] = max(peak[0], len(open_pdfs))
+        report = BuildReport()
+        report.sheets = 1
+        return pdf, report
+
+    output = io.BytesIO()
+    batch = build_batch_zip(DECKS, render_deck, output, workers=2)
+    with zipfile.ZipFile(output) as z:
+        assert z.namelist() == [f"paquets/{i}.pdf" for i in range(7)]
+        assert z.read("paquets/3.pdf") == b"paquets/3.csv"
+    assert sorted(opened) == [d.name for d in DECKS]
+    assert not open_pdfs and peak[0] <= batch_window(2)
+    assert batch.sheets == 7
+
+def test_combined_errors_are_numbered_in_their_deck():
+    # Card 2 of the second deck uses an image that cannot be decoded
+    decks = [
+        deck("a.csv", "question;texte\n" + "".join(f"Q{n};R{n}\n" for n in range(NB_CARTES + 1))),
+        deck("b.csv", "question;texte;image_recto;image_verso\nQ0;R0;;\nQ1;R1;;\n;;pc_port.png;\n"),
+    ]
+    batch = build_batch_combined(
+        decks, DEFAULT_BACK_COLOR, io.BytesIO(),
+        uploaded_recto_images=ZipImageStore(io.BytesIO(make_zip(broken=True))), multi_page=True
+    )
+    assert not batch.decks[0].errors
+    [error] = batch.decks[1].errors
+    assert (error.card, error.side) == (2, "recto")
+    assert "pour la carte 2:" in error.message
+
+def test_cancelled_batch_raises_batch_cancelled():
+    cancel = threading.Event()
+    cancel.set()
+    with pytest.raises(BatchCancelled) as raised:
+        build_batch_combined(DECKS, DEFAULT_BACK_COLOR, io.BytesIO(), multi_page=True, cancel=cancel)
+    assert raised.value.report.decks[0].name == "paquets/0.csv"
+
+    with pytest.raises(BatchCancelled):
+        build_batch_zip(DECKS, lambda d, progress, cancel: None, io.BytesIO(), cancel=cancel)
+
+def test_repetitive_csv_is_bounded_by_rows_not_by_ratio():
+    rows = "question;texte\n" + "Quelle est la capitale ?;Paris\n" * 20_000
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as z:
+        z.writestr("paquets/long.csv", rows)
+    info = zipfile.ZipFile(buf).getinfo("paquets/long.csv")
+    assert info.file_size > 100 * info.compress_size
+
+    [long_deck] = read_decks_zip(io.BytesIO(buf.getvalue()))
+    assert (long_deck.error, len(long_deck.cards)) == ("", 20_000)
+    [capped] = read_decks_zip(io.BytesIO(buf.getvalue()), max_cards=10_000)
+    assert (capped.error, capped.cards) == ("trop de cartes (maximum 10000)", [])
+
+def test_archive_wide_limits_on_csv_bytes_and_cards():
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as z:
+        for i in range(4):
+            z.writestr(f"paquets/{i}.csv", "question;texte\n" + "Q;R\n" * 100)
+    data = buf.getvalue()
+
+    decks = read_decks_zip(io.BytesIO(data), max_total_cards=250)
+    assert [len(d.cards) for d in decks] == [100, 100, 0, 0]
+    assert decks[2].error == decks[3].error == "trop de cartes dans l'archive (maximum 250)"
+
+    size = zipfile.ZipFile(io.BytesIO(data)).getinfo("paquets/0.csv").file_size
+    decks = read_decks_zip(io.BytesIO(data), max_total_bytes=3 * size)
+    assert [len(d.cards) for d in decks] == [100, 100, 100, 0]
+    assert decks[3].error.startswith("archive trop volumineuse")
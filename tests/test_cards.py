@@ -0,0 +1,156 @@
+"""
+Lecture du CSV : iter_cards_from_csv donne les mêmes cartes que le lecteur d'origine, gardé ici
+tel quel (première version de app.py) comme référence.
+"""
+import io, re, csv
+from typing import List, Dict
+
+import pytest
+
+from flashcard3 import iter_cards_from_csv, read_cards_from_csv
+
+# ----------------------------
+# Lecteur d'origine
+# ----------------------------
+def baseline_sniff_dialect(data: str) -> csv.Dialect:
+    # Priority to semicolon if it seems like the primary delimiter
+    if ';' in data:
+        try:
+            # Check if semicolon works as a reasonable delimiter (e.g., more than one field)
+            # and if it appears consistently enough to be the primary delimiter
+            f_test = io.StringIO(data)
+            test_reader = csv.reader(f_test, delimiter=';')
+            # Look at first few lines to guess consistency
+            sample_lines = data.splitlines()[:5]
+            if any(len(row) > 1 for row in csv.reader(io.StringIO(sample_lines[0]), delimiter=';')) or all(';' in line for line in sample_lines if line.strip()):
+                class SemicolonDialect(csv.excel):
+                    delimiter = ';'
+                return SemicolonDialect()
+        except Exception:
+            pass # Fall through to other options
+
+    # Then try to sniff more generally
+    sniffer = csv.Sniffer()
+    try:
+        # Sniff using common delimiters, excluding semicolon since we handled it
+        dialect = sniffer.sniff(data[:4096], delimiters=',\t')
+        return dialect
+    except csv.Error:
+        # If sniffing fails (e.g., single column data or unusual format),
+        # return excel dialect as a robust default (usually comma-delimited)
+        return csv.get_dialect('excel')
+
+def baseline_normalize_header(h: str) -> str:
+    return re.sub(r"\s+", "", (h or "").strip().lower())
+
+def baseline_read_cards_from_csv(csv_file_content: str) -> List[Dict[str, str]]:
+    """
+    CSV attendu (souple) :
+    - question : colonne 'question' (ou 1re colonne si pas d'en-tête)
+    - texte verso : colonne 'texte' / 'reponse' / 'réponse' / 'answer' (ou 2e/3e colonne selon présence d'en-tête)
+    - image recto : colonne 'image_recto' / 'imagerecto' (ou 3e colonne si pas d'en-tête)
+    - image verso : colonne 'image_verso' / 'imageverso' (ou 4e colonne si pas d'en-tête)
+    """
+    # Use io.StringIO to treat the string content as a file
+    f = io.StringIO(csv_file_content)
+
+    dialect = baseline_sniff_dialect(csv_file_content)
+    reader = csv.reader(f, dialect)
+    rows = list(reader)
+    if not rows:
+        return []
+
+    first = rows[0]
+    norm_first = [baseline_normalize_header(x) for x in first]
+    has_header = any(x in ("question","q","texte","text","reponse","réponse","answer","reponseverso","verso", "image_recto", "imagerecto", "image_verso", "imageverso") for x in norm_first)
+
+    def get_field(d: Dict[str,str], keys: List[str], fallback: str="") -> str:
+        for k in keys:
+            nk = baseline_normalize_header(k)
+            for kk, vv in d.items():
+                if baseline_normalize_header(kk) == nk:
+                    return (vv or "").strip()
+        return fallback
+
+    out = []
+    if has_header:
+        headers = norm_first
+        for r in rows[1:]:
+            if not any(str(x).strip() for x in r):
+                continue
+            d = {headers[i]: (r[i].strip() if i < len(r) else "") for i in range(len(headers))}
+            q_raw = get_field(d, ["question","q"])
+            card_color_string = None
+            question_text = q_raw # Default to raw question
+
+            # Try to find (color_name_or_hex) at the BEGINNING of the string, case-insensitive
+            match_beginning = re.match(r'^\s*\(([^)]+)\)\s*(.*)$', q_raw, re.IGNORECASE)
+            if match_beginning:
+                card_color_string = match_beginning.group(1).strip()
+                question_text = match_beginning.group(2).strip()
+            else:
+                # If not at the beginning, try to find (color_name_or_hex) at the END of the string
+                match_end = re.search(r'\s*\(([^)]+)\)\s*$', q_raw, re.IGNORECASE)
+                if match_end:
+                    card_color_string = match_end.group(1).strip()
+                    question_text = re.sub(r'\s*\(([^)]+)\)\s*$', '', q_raw, flags=re.IGNORECASE).strip()
+
+            txt = get_field(d, ["texte","text","reponse","réponse","answer","verso","reponseverso"])
+            card_image_recto = get_field(d, ["image_recto", "imagerecto"])
+            card_image_verso = get_field(d, ["image_verso", "imageverso"])
+            out.append({"question": question_text, "texte": txt, "card_color_key": card_color_string, "image_recto": card_image_recto, "image_verso": card_image_verso})
+    else:
+        # Sans en-tête : col1=question, col2=texte, col3=image_recto, col4=image_verso
+        for r in rows:
+            if not any(str(x).strip() for x in r):
+                continue
+            q_raw = (r[0].strip() if len(r) > 0 else "")
+            card_color_string = None
+            question_text = q_raw
+
+            match_beginning = re.match(r'^\s*\(([^)]+)\)\s*(.*)$', q_raw, re.IGNORECASE)
+            if match_beginning:
+                card_color_string = match_beginning.group(1).strip()
+                question_text = match_beginning.group(2).strip()
+            else:
+                match_end = re.search(r'\s*\(([^)]+)\)\s*$', q_raw, re.IGNORECASE)
+                if match_end:
+                    card_color_string = match_end.group(1).strip()
+                    question_text = re.sub(r'\s*\(([^)]+)\)\s*$', '', q_raw, flags=re.IGNORECASE).strip()
+
+            txt = (r[1].strip() if len(r) > 1 else "") # Second column for verso text
+            card_image_recto = (r[2].strip() if len(r) > 2 else "") # Third column for recto image
+            card_image_verso = (r[3].strip() if len(r) > 3 else "") # Fourth column for verso image
+            out.append({"question": question_text, "texte": txt, "card_color_key": card_color_string, "image_recto": card_image_recto, "image_verso": card_image_verso})
+
+    return out
+
+# ----------------------------
+# Cas limites
+# ----------------------------
+CASES = {
+    "en-tête, point-virgule": "question;texte;image_recto;image_verso\nQ1;R1;a.png;b.png\nQ2;R2;;\n",
+    "en-tête, virgule": "question,texte\nQ1,R1\nQ2,R2\n",
+    "en-tête, tabulation": "question\ttexte\timage_recto\nQ1\tR1\ta.png\nQ2\tR2\t\n",
+    "sans en-tête": "(bleu) q1 ; r1 ; logo.png ; photo.jpg\nq2 (#0f0) ; r2\n; ; pc_land.jpg\n",
+    "en-têtes en double": "question;question;texte;texte\nQ1;Q1 bis;R1;R1 bis\nQ2;;R2;\n",
+    "couleur en préfixe": "question;texte\n(bleu) Quelle couleur ?;Bleu\n  (#FF0000)Rouge;R\n",
+    "couleur en suffixe": "question;texte\nQuelle couleur ? (vert);Vert\nDeux (a) (b);R\n",
+    "couleur en préfixe et suffixe": "question;texte\n(bleu) Q (rouge);R\n(jaune)(vert);\n",
+    "multiligne entre guillemets": 'question;texte\n"Q1\nsuite";"R1 ; avec\n""guillemets"""\nQ2;R2\n',
+    "lignes vides et espaces": "question;texte\n\n ; \nQ1;R1\n;;\n\nQ2;R2\n",
+    "lignes courtes": "question;texte;image_recto;image_verso\nQ1\nQ2;R2;a.png\n",
+    "en-têtes alternatifs": "Q;Réponse;Image Recto;ImageVerso\nQ1;R1;a.png;b.png\n",
+    "en-tête seul": "question;texte\n",
+    "vide": "",
+    "une colonne": "Q1\nQ2\n(rose) Q3\n",
+    "fins de ligne CRLF": "question;texte\r\nQ1;R1\r\nQ2;R2\r\n",
+    "point-virgule dans le texte, virgules": 'question,texte\nQ1,"R1 ; suite"\nQ2,R2\n',
+    "en-tête avec BOM": "﻿question;texte\nQ1;R1\n",
+}
+
+@pytest.mark.parametrize("content", CASES.values(), ids=CASES.keys())
+def test_same_cards_as_the_original_reader(content):
+    expected = baseline_read_cards_from_csv(content)
+    assert read_cards_from_csv(content) == expected
+    assert [card._asdict() for card in iter_cards_from_csv(content)] == expected
@@ -0,0 +1,24 @@
+"""Rendu sans interface : le PDF n'est remplacé qu'une fois complet."""
+import os
+
+from flashcard3 import cli
+from flashcard3.pdf import RECTO_STYLE_FILL
+
+def job(tmp_path) -> cli.RenderJob:
+    csv_path = tmp_path / "paquet.csv"
+    csv_path.write_text("question;texte\nQ1;R1\n", encoding="utf-8")
+    return cli.RenderJob(str(csv_path), str(tmp_path / "paquet.pdf"), None, RECTO_STYLE_FILL, False,
+                         None, None, 1, True, False, False, None, 0)
+
+def test_failed_build_keeps_the_previous_pdf(tmp_path, monkeypatch):
+    assert cli.render_deck(job(tmp_path))["ok"]
+    previous = (tmp_path / "paquet.pdf").read_bytes()
+
+    def build_pdf(cards, default_back_color, output, **options):
+        output.write(b"%PDF-1.4 partiel")
+        raise OSError("disque plein")
+    monkeypatch.setattr(cli, "build_pdf", build_pdf)
+    result = cli.render_deck(job(tmp_path))
+    assert not result["ok"] and result["error"] == "OSError: disque plein"
+    assert (tmp_path / "paquet.pdf").read_bytes() == previous
+    assert sorted(os.listdir(tmp_path)) == ["paquet.csv", "paquet.pdf"]
@@ -0,0 +1,45 @@
+"""Cache disque des images traitées : version du code dans les clés, répertoire en lecture seule, entrées abîmées."""
+import os
+
+from PIL import Image
+from reportlab.lib.utils import ImageReader
+
+from flashcard3 import disk_cache
+from flashcard3.disk_cache import DiskImageCache
+from flashcard3.images import ProcessedImage
+
+from test_reproducible import render
+
+KEY = ("digest", None, False, (10, 20), None)
+
+def put_image(cache: DiskImageCache):
+    pixels = Image.new("RGB", (10, 20), (30, 120, 200))
+    cache.put(KEY, ProcessedImage(ImageReader(pixels), None, pixels.size, False, None), pixels)
+
+def test_entries_are_keyed_by_code_version(tmp_path, monkeypatch):
+    cache = DiskImageCache(str(tmp_path))
+    put_image(cache)
+    assert cache.get(KEY).size == (10, 20)
+
+    monkeypatch.setattr(disk_cache, "code_digest", lambda: "autre version")
+    assert cache.get(KEY) is None
+
+def test_read_only_hit_is_still_a_hit(tmp_path, monkeypatch):
+    cache = DiskImageCache(str(tmp_path))
+    put_image(cache)
+
+    def utime(*args, **kwargs):
+        raise PermissionError("lecture seule")
+    monkeypatch.setattr(os, "utime", utime)
+    assert cache.get(KEY).size == (10, 20)
+
+def test_truncated_cached_jpeg_is_reprocessed(tmp_path):
+    cache = DiskImageCache(str(tmp_path))
+    expected, _ = render(1, jpeg_quality=80)
+    render(1, disk_cache=cache, jpeg_quality=80)
+    for _, size, path in cache.entries():
+        os.truncate(path, size - 50)
+
+    pdf, report = render(1, disk_cache=cache, jpeg_quality=80)
+    assert not report.errors and report.profile.counters["images_processed"] > 0
+    assert pdf == expected
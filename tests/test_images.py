@@ -0,0 +1,68 @@
+"""Archive d'images et images du PDF : index par nom de fichier, doublons signalés, intégration."""
+import io, re, zipfile
+
+import pytest
+
+from PIL import Image
+from reportlab.pdfgen import canvas
+
+from flashcard3 import DEFAULT_BACK_COLOR, ZipImageStore, build_pdf, iter_cards_from_csv
+
+from test_reproducible import make_zip, render
+
+def png(color) -> bytes:
+    data = io.BytesIO()
+    Image.new("RGB", (8, 8), color).save(data, format="PNG")
+    return data.getvalue()
+
+def test_same_name_in_another_folder_is_reported():
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as z:
+        z.writestr("a/logo.png", png((255, 0, 0)))
+        z.writestr("b/logo.png", png((0, 0, 255)))
+        z.writestr("b/photo.png", png((0, 255, 0)))
+    store = ZipImageStore(io.BytesIO(buf.getvalue()))
+
+    assert sorted(store) == ["logo.png", "photo.png"]
+    assert store["logo.png"].info.filename == "a/logo.png"
+    assert store["logo.png"].open_image().convert("RGB").getpixel((0, 0)) == (255, 0, 0)
+    assert store.rejected == {"b/logo.png": "Image b/logo.png ignorée : même nom de fichier que a/logo.png"}
+
+def test_highly_compressible_image_still_loads():
+    data = io.BytesIO()
+    Image.new("RGB", (4000, 3000), (255, 255, 255)).save(data, format="JPEG", quality=95)
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as z:
+        z.writestr("blanc.jpg", data.getvalue())
+    info = zipfile.ZipFile(buf).getinfo("blanc.jpg")
+    assert info.file_size > 100 * info.compress_size
+
+    store = ZipImageStore(io.BytesIO(buf.getvalue()))
+    assert not store.rejected
+    assert store["blanc.jpg"].size == (4000, 3000)
+    assert store["blanc.jpg"].open_image((400, 300)).getpixel((0, 0))[:3] == (255, 255, 255)
+
+def test_opaque_image_is_processed_once_for_all_card_colours():
+    csv = "question;texte;image_recto;image_verso\n(bleu) A;;photo.jpg;\n(rouge) B;;photo.jpg;\n(vert) C;;logo.png;\n(rose) D;;logo.png;\n"
+    report = build_pdf(list(iter_cards_from_csv(csv)), DEFAULT_BACK_COLOR, io.BytesIO(),
+                       uploaded_recto_images=ZipImageStore(io.BytesIO(make_zip())), image_workers=1)
+    # The transparent logo is composited on each card colour, the photo is not
+    assert not report.errors and report.profile.counters["images_processed"] == 3
+
+@pytest.mark.parametrize("options", [{}, {"jpeg_quality": 80}, {"image_soft_mask": True}])
+def test_report_counts_the_image_objects_in_the_pdf(options):
+    pdf, report = render(1, page_compression=False, **options)
+    images = re.findall(rb"<<([^>]*/Subtype /Image[^>]*)>>", pdf)
+    masks = len(re.findall(rb"/SMask \d+ 0 R", pdf))
+    assert report.images_embedded == len(images) - masks
+    assert report.image_bytes_embedded == sum(int(re.search(rb"/Length (\d+)", d).group(1)) for d in images)
+
+def test_image_failing_inside_its_form_falls_back_to_text(monkeypatch):
+    def draw_image(*args, **kwargs):
+        raise OSError("image illisible")
+    monkeypatch.setattr(canvas.Canvas, "drawImage", draw_image)
+    # Every card side with an image is reported; the pages after it are not drawn into its form
+    pdf, report = render(1, page_compression=False)
+    assert len(report.errors) == 17
+    assert len(re.findall(rb"/Type /Page\b", pdf)) == 2 * report.sheets
+    assert b"(Paris)" in pdf
@@ -0,0 +1,32 @@
+"""build_pdf : flux binaires pendant la génération, réglage de ReportLab rétabli ensuite ; texte ajusté aux cartes."""
+import io
+
+import pytest
+from reportlab import rl_config
+from reportlab.lib import colors
+
+from flashcard3 import DEFAULT_BACK_COLOR, build_pdf, iter_cards_from_csv
+from flashcard3.pdf import MIN_FONT_SIZE, TextStyle, fit_text_in_box
+
+def test_streams_are_binary_and_the_setting_is_restored():
+    assert rl_config.useA85 # ReportLab's default, left alone at import
+    output = io.BytesIO()
+    build_pdf(list(iter_cards_from_csv("question;texte\nQ1;R1\n")), DEFAULT_BACK_COLOR, output, page_compression=True)
+    assert b"ASCII85Decode" not in output.getvalue()
+    assert rl_config.useA85
+
+STYLE = TextStyle("test", "Helvetica", 12, 14.4, colors.black)
+BOX = (10, 20, 160, 240) # x, y, w, h
+
+@pytest.mark.parametrize("words, font_size", [(1, 12), (150, None), (2000, MIN_FONT_SIZE)])
+def test_text_is_shrunk_and_kept_inside_the_card(words, font_size):
+    x, y, w, h = BOX
+    p, text_x, text_y = fit_text_in_box(x, y, w, h, "mot " * words, STYLE)
+    size = p.style.fontSize
+    if font_size is None: # shrunk, but not down to the minimum
+        assert MIN_FONT_SIZE < size < STYLE.font_size
+    else:
+        assert size == font_size
+    # Every line fits in the width (centred: positive extra space), all lines fit in the height
+    assert x <= text_x and all(line[0] >= 0 for line in p.blPara.lines)
+    assert y <= text_y and text_y + len(p.blPara.lines) * p.style.leading <= y + h
@@ -0,0 +1,100 @@
+"""Service de génération : admission, tour de rôle sans famine des gros paquets, annulation."""
+import threading, time
+
+import pytest
+
+from flashcard3 import iter_cards_from_csv
+from flashcard3.jobs import JOB_CANCELLED, JOB_DONE, PdfJob
+from flashcard3.pdf import BuildCancelled
+from flashcard3.render_service import RenderService, RenderServiceBusy, estimate_job_memory
+
+class Gate:
+    """Génération qui attend qu'on la libère, pour piloter l'ordre de démarrage."""
+    def __init__(self, name: str, started: list):
+        self.name = name
+        self.started = started
+        self.release = threading.Event()
+        self.job = PdfJob(name, self.render, 1)
+
+    def render(self, progress, cancel):
+        self.started.append(self.name)
+        while not self.release.wait(0.01):
+            if cancel.is_set():
+                raise BuildCancelled(None)
+        return None, None
+
+def wait_until(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "délai dépassé"
+        time.sleep(0.005)
+
+def test_admission_limits():
+    service = RenderService(workers=1, memory_budget=100, max_queued=2, jobs_per_session=1)
+    started = []
+    with pytest.raises(RenderServiceBusy, match="trop lourd"):
+        service.submit(Gate("lourd", started).job, "s0", 101)
+
+    first = Gate("a", started)
+    service.submit(first.job, "s1", 10)
+    with pytest.raises(RenderServiceBusy, match="déjà en cours"):
+        service.submit(Gate("b", started).job, "s1", 10)
+    wait_until(lambda: started == ["a"])
+
+    queued = [Gate("c", started), Gate("d", started)]
+    service.submit(queued[0].job, "s2", 10)
+    service.submit(queued[1].job, "s3", 10)
+    with pytest.raises(RenderServiceBusy, match="saturé"):
+        service.submit(Gate("e", started).job, "s4", 10)
+    for gate in [first] + queued:
+        gate.release.set()
+    wait_until(lambda: started == ["a", "c", "d"])
+
+def test_large_job_is_not_starved_by_small_ones():
+    service = RenderService(workers=4, memory_budget=100, max_queued=10, max_skips=2)
+    started = []
+    gates = {name: Gate(name, started) for name in "abcde"}
+    service.submit(gates["a"].job, "s1", 60)
+    wait_until(lambda: started == ["a"])
+    # b does not fit beside a; c and d do, and start past it
+    service.submit(gates["b"].job, "s2", 100)
+    service.submit(gates["c"].job, "s3", 20)
+    wait_until(lambda: started == ["a", "c"])
+    service.submit(gates["d"].job, "s4", 10)
+    wait_until(lambda: started == ["a", "c", "d"])
+    # b has been passed over twice: e would fit but waits behind it
+    service.submit(gates["e"].job, "s5", 10)
+    assert service.position(gates["b"].job) == 1 and service.position(gates["e"].job) == 2
+    time.sleep(0.05)
+    assert started == ["a", "c", "d"]
+
+    for name in "acd":
+        gates[name].release.set()
+    wait_until(lambda: started == ["a", "c", "d", "b"])
+    assert service.memory_in_use == 100
+    gates["b"].release.set()
+    wait_until(lambda: started == ["a", "c", "d", "b", "e"])
+    gates["e"].release.set()
+    wait_until(lambda: all(gate.job.state == JOB_DONE for gate in gates.values()))
+    assert service.memory_in_use == 0
+
+def test_cancel_pending_and_running_jobs():
+    service = RenderService(workers=1, memory_budget=100)
+    started = []
+    running, pending = Gate("running", started), Gate("pending", started)
+    service.submit(running.job, "s1", 10)
+    wait_until(lambda: started == ["running"])
+    service.submit(pending.job, "s2", 10)
+
+    service.cancel(pending.job)
+    assert pending.job.state == JOB_CANCELLED and service.position(pending.job) is None
+    service.cancel(running.job)
+    wait_until(lambda: running.job.state == JOB_CANCELLED)
+    assert started == ["running"]
+    wait_until(lambda: service.running == 0 and service.memory_in_use == 0)
+
+def test_memory_estimate_counts_cards_without_images():
+    small = list(iter_cards_from_csv("question;texte\n" + "Q;R\n" * 9))
+    large = list(iter_cards_from_csv("question;texte\n" + "Q;R\n" * 9000))
+    assert estimate_job_memory(large, None, True, 300) > estimate_job_memory(small, None, True, 300)
+    assert estimate_job_memory(large, None, False, 300) == estimate_job_memory(small, None, False, 300)
@@ -0,0 +1,84 @@
+"""Un PDF `reproducible` ne dépend ni du nombre de threads d'images ni de l'état des caches."""
+import io, zipfile
+
+import pytest
+from PIL import Image, ImageDraw
+
+from flashcard3 import DEFAULT_BACK_COLOR, RenderCache, ZipImageStore, build_pdf, iter_cards_from_csv
+
+CSV = """question;texte;image_recto;image_verso
+(bleu) Quelle est la capitale ?;Paris;photo.jpg;
+(#F00) Avec image;Réponse;logo.png;logo.png
+;;pc_land.jpg;pc_port.png
+(vert);Texte verso;photo.jpg;logo.png
+Q cinq (jaune);;;photo.jpg
+(#abc) Six;Sept;logo.png;
+(rose) huit;neuf;pc_port.png;photo.jpg
+(rouge) dix;onze;pc_land.jpg;
+(blanc) douze;treize;logo.png;pc_port.png
+(bleu) quatorze;quinze;;photo.jpg
+(vert) seize;dix-sept;photo.jpg;pc_land.jpg
+"""
+
+def make_zip(broken: bool = False) -> bytes:
+    images = {
+        "logo.png": Image.new("RGBA", (300, 400), (0, 0, 0, 0)),
+        "pc_land.jpg": Image.new("RGB", (1600, 1000), (30, 120, 200)),
+        "pc_port.png": Image.new("RGB", (800, 1200), (10, 200, 100)),
+        "photo.jpg": Image.new("RGB", (2000, 1500), (220, 220, 220)),
+    }
+    ImageDraw.Draw(images["logo.png"]).ellipse((20, 20, 280, 380), fill=(200, 30, 30, 255))
+    ImageDraw.Draw(images["pc_land.jpg"]).rectangle((100, 100, 700, 500), fill=(250, 250, 0))
+    ImageDraw.Draw(images["photo.jpg"]).line((0, 0, 2000, 1500), fill=(255, 0, 0), width=30)
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as z:
+        for name, img in images.items():
+            data = io.BytesIO()
+            img.save(data, format="JPEG" if name.endswith(".jpg") else "PNG")
+            data = data.getvalue()
+            if broken and name == "pc_port.png":
+                data = data[:200] # header readable, pixels truncated
+            z.writestr(name, data)
+    return buf.getvalue()
+
+def render(image_workers: int, render_cache=None, broken: bool = False, csv: str = CSV, **options):
+    output = io.BytesIO()
+    report = build_pdf(
+        list(iter_cards_from_csv(csv)), DEFAULT_BACK_COLOR, output,
+        uploaded_recto_images=ZipImageStore(io.BytesIO(make_zip(broken))),
+        multi_page=True, image_workers=image_workers, render_cache=render_cache,
+        reproducible=True, **options
+    )
+    return output.getvalue(), report
+
+@pytest.mark.parametrize("options", [{}, {"jpeg_quality": 80, "image_soft_mask": True}])
+def test_same_bytes_whatever_the_workers_and_cache(options):
+    expected, report = render(1, **options)
+    assert report.sheets == 2 and not report.errors
+
+    assert render(4, **options)[0] == expected
+
+    cache = RenderCache()
+    assert render(4, cache, **options)[0] == expected
+    pdf, warm = render(4, cache, **options)
+    assert warm.sheets_reused == 2 and warm.images_reused > 0
+    assert pdf == expected
+    assert render(1, cache, **options)[0] == expected
+
+def test_broken_image_falls_back_the_same_way_whatever_the_workers():
+    # The image cannot be decoded: each card using it is drawn with its text fallback and reported
+    expected, report = render(1, broken=True)
+    assert {(error.card, error.side) for error in report.errors} == {(2, "verso"), (6, "recto"), (8, "verso")}
+
+    for workers in (2, 4):
+        pdf, threaded = render(workers, broken=True)
+        assert threaded.errors == report.errors
+        assert pdf == expected
+
+def test_edited_deck_with_warm_cache_matches_a_fresh_build():
+    cache = RenderCache()
+    render(4, cache)
+    edited = CSV.replace("(rouge) dix;onze;pc_land.jpg;", "(rouge) dix;onze modifié;photo.jpg;")
+    pdf, report = render(4, cache, csv=edited)
+    assert report.sheets_reused == 1
+    assert pdf == render(1, csv=edited)[0]